@@ -0,0 +1 @@
+# Copyright 2019, Aiven, https://aiven.io/
@@ -0,0 +1,63 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# Compare decoding and mapping telegraf json and influx (line protocol) output
+# of the same synthetic batch:
+#
+#   python -m benchmarks.formats --hosts 1000 --rounds 10
+#
+import argparse
+import json
+import logging
+import time
+
+from sfxbridge import lineprotocol
+from sfxbridge.mapper import Mapper
+from sfxbridge.stream import iter_metrics
+
+from .generator import telegraf_batch, to_line_protocol
+
+
+def _timed(fn, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark decoding telegraf json and influx formats")
+    parser.add_argument("--hosts", type=int, default=1000, help="number of hosts in the batch")
+    parser.add_argument("--rounds", type=int, default=10, help="number of rounds, the best one is reported")
+    args = parser.parse_args()
+
+    batch = telegraf_batch(hosts=args.hosts)
+    json_body = json.dumps(batch).encode("utf-8")
+    influx_body = to_line_protocol(batch)
+    metric_count = len(batch["metrics"])
+    mapper = Mapper(log=logging.getLogger(), whitelist=set(Mapper.supported_datapoints()), service=None)
+
+    def decode_and_map(metrics):
+        mapper.clear()
+        mapper.process(metrics)
+
+    cases = [
+        ("json", len(json_body), lambda: json.loads(json_body)["metrics"]),
+        ("json streaming", len(json_body), lambda: list(iter_metrics(json_body))),
+        ("influx", len(influx_body), lambda: list(lineprotocol.parse(influx_body))),
+    ]
+    print(f"{metric_count} metrics")
+    print(f"{'format':<16} {'bytes':>10} {'decode':>10} {'metrics/s':>12} {'decode+map':>12} {'metrics/s':>12}")
+    for name, size, decode in cases:
+        decode_time = _timed(decode, args.rounds)
+        total_time = _timed(lambda decode=decode: decode_and_map(decode()), args.rounds)
+        print(
+            f"{name:<16} {size:>10} {decode_time:>9.4f}s {metric_count / decode_time:>12.0f} "
+            f"{total_time:>11.4f}s {metric_count / total_time:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# Generator for synthetic telegraf batches
+#
+import random
+import time
+from typing import List
+
+
+KAFKA_REQUEST_TYPES = ("Produce", "FetchConsumer", "FetchFollower", "Metadata", "OffsetCommit")
+
+
+def host_metrics(*, host: str, service: str, timestamp: int, interfaces: int = 2, disks: int = 1) -> List[dict]:
+    tags = {
+        "cloud": "google-europe-west1",
+        "host": host,
+        "project": "benchmark",
+        "service": service,
+        "service_type": "kafka",
+    }
+    metrics = [
+        {
+            "name": "cpu",
+            "tags": {
+                **tags, "cpu": "cpu-total"
+            },
+            "fields": {
+                "usage_idle": random.uniform(0, 100),
+                "usage_system": random.uniform(0, 10),
+                "usage_user": random.uniform(0, 50),
+            },
+            "timestamp": timestamp,
+        },
+        {
+            "name": "system",
+            "tags": tags,
+            "fields": {
+                "load1": random.random(),
+                "load5": random.random(),
+                "load15": random.random(),
+                "n_cpus": 4,
+            },
+            "timestamp": timestamp,
+        },
+        {
+            "name": "mem",
+            "tags": tags,
+            "fields": {
+                "active": random.randint(0, 1 << 32),
+                "buffered": random.randint(0, 1 << 32),
+                "cached": random.randint(0, 1 << 32),
+                "free": random.randint(0, 1 << 32),
+                "inactive": random.randint(0, 1 << 32),
+                "used": random.randint(0, 1 << 32),
+                "used_percent": random.uniform(0, 100),
+                "wired": 0,
+            },
+            "timestamp": timestamp,
+        },
+    ]
+    for interface in range(interfaces):
+        metrics.append({
+            "name": "net",
+            "tags": {
+                **tags, "interface": f"eth{interface}"
+            },
+            "fields": {
+                "bytes_recv": random.randint(0, 1 << 40),
+                "bytes_sent": random.randint(0, 1 << 40),
+                "err_in": 0,
+                "err_out": 0,
+            },
+            "timestamp": timestamp,
+        })
+    metrics.append({
+        "name": "swap",
+        "tags": tags,
+        "fields": {
+            "in": random.randint(0, 1 << 20),
+            "out": random.randint(0, 1 << 20),
+        },
+        "timestamp": timestamp,
+    })
+    for disk in range(disks):
+        device = f"sd{chr(ord('a') + disk % 26)}"
+        metrics.append({
+            "name": "disk",
+            "tags": {
+                **tags, "device": device,
+                "fstype": "ext4",
+                "path": f"/srv/disk{disk}"
+            },
+            "fields": {
+                "free": random.randint(0, 1 << 40),
+                "used": random.randint(0, 1 << 40),
+                "used_percent": random.uniform(0, 100),
+            },
+            "timestamp": timestamp,
+        })
+        metrics.append({
+            "name": "diskio",
+            "tags": {
+                **tags, "name": device
+            },
+            "fields": {
+                "reads": random.randint(0, 1 << 32),
+                "writes": random.randint(0, 1 << 32),
+            },
+            "timestamp": timestamp,
+        })
+    return metrics
+
+
+def kafka_metrics(*, host: str, service: str, timestamp: int, topics: int = 10) -> List[dict]:
+    """Returns the jolokia metrics of a kafka broker as telegraf reports them"""
+    tags = {
+        "host": host,
+        "project": "benchmark",
+        "service": service,
+        "service_type": "kafka",
+    }
+
+    def metric(name, fields, **extra_tags):
+        return {"name": name, "tags": {**tags, **extra_tags}, "fields": fields, "timestamp": timestamp}
+
+    metrics = [
+        metric("kafka.server:ReplicaManager.IsrExpandsPerSec", {"Count": random.randint(0, 100)}),
+        metric("kafka.server:ReplicaManager.IsrShrinksPerSec", {"Count": random.randint(0, 100)}),
+        metric("kafka.controller:ControllerStats.LeaderElectionRateAndTimeMs", {"Count": random.randint(0, 100)}),
+        metric("kafka.controller:ControllerStats.UncleanLeaderElectionsPerSec", {"Count": 0}),
+        metric("kafka.log:LogFlushStats.LogFlushRateAndTimeMs", {"Count": random.randint(0, 1 << 20)}),
+        metric("kafka.controller:KafkaController.ActiveControllerCount", {"Value": random.randint(0, 1)}),
+        metric("kafka.controller:KafkaController.OfflinePartitionsCount", {"Value": 0}),
+        metric("kafka.server:ReplicaManager.UnderReplicatedPartitions", {"Value": 0}),
+    ]
+    for topic in [None] + [f"topic-{index}" for index in range(topics)]:
+        topic_tags = {"topic": topic} if topic else {}
+        for name in ("BytesInPerSec", "BytesOutPerSec", "MessagesInPerSec"):
+            metrics.append(
+                metric(
+                    f"kafka.server:BrokerTopicMetrics.{name}", {
+                        "Count": random.randint(0, 1 << 40),
+                        "OneMinuteRate": random.uniform(0, 1 << 20)
+                    }, **topic_tags
+                )
+            )
+    for request in KAFKA_REQUEST_TYPES:
+        metrics.append(
+            metric(
+                "kafka.network:RequestMetrics.TotalTimeMs", {
+                    "Count": random.randint(0, 1 << 32),
+                    "Mean": random.uniform(0, 100),
+                    "99thPercentile": random.uniform(0, 1000),
+                },
+                request=request
+            )
+        )
+    return metrics
+
+
+def telegraf_batch(
+    *,
+    hosts: int,
+    service: str = "bench",
+    timestamp: int = None,
+    interfaces: int = 2,
+    disks: int = 1,
+    topics: int = 0,
+) -> dict:
+    """
+    Returns telegraf json output with the metrics of the given number of hosts,
+    including kafka broker metrics with the given number of topics if any
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    metrics = []
+    for host in range(hosts):
+        name = f"{service}-{host}"
+        metrics.extend(host_metrics(host=name, service=service, timestamp=timestamp, interfaces=interfaces, disks=disks))
+        if topics:
+            metrics.extend(kafka_metrics(host=name, service=service, timestamp=timestamp, topics=topics))
+    return {"metrics": metrics}
+
+
+def _escape(value: str, chars: str) -> str:
+    for char in chars:
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def _line_protocol_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def to_line_protocol(batch: dict) -> bytes:
+    """Serialize telegraf json batch to influx line protocol as telegraf would"""
+    lines = []
+    for metric in batch["metrics"]:
+        series = [_escape(metric["name"], ", ")]
+        for key, value in sorted(metric["tags"].items()):
+            series.append(f"{_escape(key, ',= ')}={_escape(value, ',= ')}")
+        fields = ",".join(
+            f"{_escape(key, ',= ')}={_line_protocol_value(value)}" for key, value in metric["fields"].items()
+        )
+        lines.append(f"{','.join(series)} {fields} {metric['timestamp'] * 1000000000}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
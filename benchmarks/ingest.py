@@ -0,0 +1,61 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# Fake SignalFX ingest API running in a separate process
+#
+import asyncio
+import gzip
+import json
+import multiprocessing
+import time
+
+from aiohttp import web
+
+
+def _serve(port, latency, received, ready):
+    async def ingest(request):
+        body = await request.read()
+        if request.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        count = 0
+        if request.content_type == "application/json":
+            count = sum(len(dps) for dps in json.loads(body).values())
+        if latency:
+            await asyncio.sleep(latency)
+        with received.get_lock():
+            received.value += count
+        return web.Response()
+
+    async def on_startup(_):
+        ready.set()
+
+    app = web.Application(client_max_size=1024 * 1024 * 1024)
+    app.add_routes([web.post("/v2/datapoint", ingest)])
+    app.on_startup.append(on_startup)
+    web.run_app(app, host="127.0.0.1", port=port, access_log=None, print=None)
+
+
+class FakeIngest:
+    """Fake ingest API replying after the given latency, counts the received json datapoints"""
+    def __init__(self, *, port: int = 9099, latency: float = 0.0):
+        self.port = port
+        self.received = multiprocessing.Value("q", 0)
+        self._ready = multiprocessing.Event()
+        self._process = multiprocessing.Process(target=_serve, args=(port, latency, self.received, self._ready), daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v2/datapoint"
+
+    def __enter__(self):
+        self._process.start()
+        self._ready.wait(timeout=10)
+        time.sleep(0.1)
+        return self
+
+    def __exit__(self, *args):
+        self._process.terminate()
+        self._process.join()
+
+    def reset(self) -> None:
+        with self.received.get_lock():
+            self.received.value = 0
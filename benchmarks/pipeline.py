@@ -0,0 +1,178 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# Benchmark the mapping and sending pipeline with synthetic telegraf batches
+# of kafka brokers, reporting the throughput, allocations and peak memory of
+# each stage:
+#
+#   python -m benchmarks.pipeline --hosts 50 --interfaces 4 --disks 2 --topics 100
+#
+# mapper:  Mapper.process() of a decoded batch
+# process: SfxClient.process(), i.e. mapping, encoding and posting to a local
+#          fake ingest API
+# http:    POSTing the batches to the bridge http server until the fake
+#          ingest API has received all the datapoints
+#
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import threading
+import time
+import tracemalloc
+
+import requests
+from aiohttp import web
+
+from sfxbridge.mapper import Mapper
+from sfxbridge.sfxbridge import _HttpServer, SfxBridge, SfxClient
+
+from .generator import telegraf_batch
+from .ingest import FakeIngest
+
+
+def _measure(fn, rounds):
+    """
+    Returns the best time of the rounds, and the number of memory blocks left
+    allocated by and the peak memory use of one more, traced, round
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return best, blocks, peak
+
+
+def _report(name, elapsed, metrics, datapoints, blocks=None, peak=None):
+    memory = ""
+    if blocks is not None:
+        memory = f" {blocks:>10} blocks {peak / (1 << 20):>8.1f} MiB peak"
+    print(
+        f"{name:<8} {elapsed:>9.4f}s {metrics / elapsed:>12.0f} metrics/s "
+        f"{datapoints / elapsed:>12.0f} datapoints/s{memory}"
+    )
+
+
+def bench_mapper(batches, rounds):
+    mapper = Mapper(log=logging.getLogger(), whitelist=set(Mapper.supported_datapoints(service="kafka")), service="kafka")
+    datapoints = 0
+
+    def run():
+        nonlocal datapoints
+        datapoints = 0
+        for batch in batches:
+            mapper.clear()
+            mapper.process(batch["metrics"])
+            datapoints += sum(len(dps) for dps in mapper.datapoints.values())
+
+    elapsed, blocks, peak = _measure(run, rounds)
+    _report("mapper", elapsed, sum(len(batch["metrics"]) for batch in batches), datapoints, blocks, peak)
+    return datapoints
+
+
+def bench_process(config, batches, rounds, ingest, datapoints):
+    client = SfxClient(config=config, queue=None, server=_HttpServer(config=config))
+    client._url = ingest.url  # pylint: disable=protected-access
+
+    def run():
+        for batch in batches:
+            client.process(batch)
+
+    elapsed, blocks, peak = _measure(run, rounds)
+    _report("process", elapsed, sum(len(batch["metrics"]) for batch in batches), datapoints, blocks, peak)
+
+
+def bench_http(config, bodies, metrics, datapoints, ingest, port, timeout):
+    bridge = SfxBridge(config={**config, "host": "127.0.0.1", "port": port, "daemon": False})
+    bridge.app["sfx_client"]._url = ingest.url  # pylint: disable=protected-access
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(bridge.app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    server = threading.Thread(target=loop.run_forever, daemon=True)
+    server.start()
+    if bridge._client is not None:  # pylint: disable=protected-access
+        bridge._client.start()  # pylint: disable=protected-access
+
+    ingest.reset()
+    session = requests.Session()
+    start = time.perf_counter()
+    try:
+        for body in bodies:
+            while True:
+                response = session.post(f"http://127.0.0.1:{port}/", data=body)
+                if response.status_code != 503:
+                    response.raise_for_status()
+                    break
+                time.sleep(0.01)  # buffer full, retry as telegraf would
+        deadline = start + timeout
+        while ingest.received.value < datapoints:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Only {ingest.received.value} of {datapoints} datapoints received")
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        server.join()
+        if bridge._client is not None:  # pylint: disable=protected-access
+            bridge._client.join()  # pylint: disable=protected-access
+    _report("http", elapsed, metrics, datapoints)
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the mapping and sending pipeline")
+    parser.add_argument("--batches", type=int, default=10, help="number of telegraf POSTs")
+    parser.add_argument("--hosts", type=int, default=50, help="number of kafka brokers per POST")
+    parser.add_argument("--interfaces", type=int, default=2, help="network interfaces per host")
+    parser.add_argument("--disks", type=int, default=2, help="disks per host")
+    parser.add_argument("--topics", type=int, default=100, help="kafka topics per broker")
+    parser.add_argument("--rounds", type=int, default=5, help="number of rounds, the best one is reported")
+    parser.add_argument("--sender", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--port", type=int, default=9098, help="port for the bridge http server")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for all datapoints to be sent")
+    args = parser.parse_args()
+
+    config = {
+        "realm": "benchmark",
+        "service": "kafka",
+        "sender": args.sender,
+        "log_level": "ERROR",
+        "max_body_bytes": 64 * 1024 * 1024,
+    }
+    batches = [
+        telegraf_batch(
+            hosts=args.hosts,
+            service="kafka",
+            timestamp=1570444470 + index * 10,
+            interfaces=args.interfaces,
+            disks=args.disks,
+            topics=args.topics,
+        ) for index in range(args.batches)
+    ]
+    bodies = [json.dumps(batch).encode("utf-8") for batch in batches]
+    metrics = sum(len(batch["metrics"]) for batch in batches)
+    print(
+        f"{args.batches} batches of {args.hosts} brokers, {metrics} metrics, "
+        f"{sum(len(body) for body in bodies)} bytes of json"
+    )
+
+    datapoints = bench_mapper(batches, args.rounds)
+    with FakeIngest() as ingest:
+        bench_process(config, batches, args.rounds, ingest, datapoints)
+        bench_http(config, bodies, metrics, datapoints, ingest, args.port, args.timeout)
+    print(f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
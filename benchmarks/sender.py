@@ -0,0 +1,98 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# Compare the thread and asyncio senders under synthetic load:
+#
+#   python -m benchmarks.sender --batches 50 --hosts 100 --latency 0.2 --max-in-flight 4
+#
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from sfxbridge.buffer import AsyncIngestBuffer, IngestBuffer, OverflowPolicy
+from sfxbridge.sfxbridge import _HttpServer, AsyncSfxClient, DataFormat, SfxClient
+
+from .generator import telegraf_batch
+from .ingest import FakeIngest
+
+
+def _expected_datapoints(config, batch):
+    client = SfxClient(config=config, queue=None, server=_HttpServer(config=config))
+    return sum(len(dps) for dps in client._map(batch).values())  # pylint: disable=protected-access
+
+
+def _wait_received(ingest, expected, timeout=300.0):
+    deadline = time.monotonic() + timeout
+    while ingest.received.value < expected and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def run_thread(config, batches, expected, ingest):
+    buffer = IngestBuffer(max_batches=len(batches), max_bytes=1 << 40, overflow=OverflowPolicy.reject)
+    client = SfxClient(config=config, queue=buffer, server=_HttpServer(config=config))
+    client._url = ingest.url  # pylint: disable=protected-access
+    sender = threading.Thread(target=client.run)
+    sender.start()
+    start = time.monotonic()
+    for batch, size in batches:
+        buffer.put(batch, size)
+    _wait_received(ingest, expected)
+    elapsed = time.monotonic() - start
+    client.stop()
+    sender.join()
+    return elapsed
+
+
+def run_asyncio(config, batches, expected, ingest):
+    async def run():
+        buffer = AsyncIngestBuffer(max_batches=len(batches), max_bytes=1 << 40, overflow=OverflowPolicy.reject)
+        client = AsyncSfxClient(config=config, queue=buffer, server=_HttpServer(config=config))
+        client._url = ingest.url  # pylint: disable=protected-access
+        sender = asyncio.ensure_future(client.run())
+        start = time.monotonic()
+        for batch, size in batches:
+            buffer.put(batch, size)
+        while ingest.received.value < expected:
+            await asyncio.sleep(0.001)
+        elapsed = time.monotonic() - start
+        client.stop()
+        await sender
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark the thread and asyncio senders")
+    parser.add_argument("--batches", type=int, default=50, help="number of telegraf POSTs")
+    parser.add_argument("--hosts", type=int, default=100, help="number of hosts per POST")
+    parser.add_argument("--latency", type=float, default=0.1, help="latency of the fake ingest API in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=1)
+    args = parser.parse_args()
+
+    config = {
+        "realm": "benchmark",
+        "max_in_flight": args.max_in_flight,
+        "log_level": "ERROR",
+    }
+    batches = []
+    for i in range(args.batches):
+        body = json.dumps(telegraf_batch(hosts=args.hosts, timestamp=1570444470 + i * 10)).encode("utf-8")
+        batches.append(((DataFormat.json, body), len(body)))
+    per_batch = _expected_datapoints(config, json.loads(batches[0][0][1]))
+    expected = per_batch * args.batches
+
+    print(f"{args.batches} batches of {per_batch} datapoints, latency {args.latency}s, max_in_flight {args.max_in_flight}")
+    with FakeIngest(latency=args.latency) as ingest:
+        for name, fn in [("thread", run_thread), ("asyncio", run_asyncio)]:
+            ingest.reset()
+            elapsed = fn(config, batches, expected, ingest)
+            print(
+                f"{name:>8}: {elapsed:8.3f}s {args.batches / elapsed:10.1f} batches/s "
+                f"{expected / elapsed:12.0f} datapoints/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,8 +9,10 @@ setup(
     author="Aiven Oy",
     author_email="support@aiven.io",
     zip_safe=False,
-    packages=find_packages(exclude=["tests"]),
-    extras_require={},
+    packages=find_packages(exclude=["benchmarks", "tests"]),
+    extras_require={
+        "fast-json": ["orjson"],
+    },
     dependency_links=[],
     package_data={},
     data_files=[],
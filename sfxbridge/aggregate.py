@@ -0,0 +1,91 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Aggregation of the datapoints of multiple telegraf flushes over a time
+# window, so that each series is sent once per window
+#
+import time
+from typing import Dict, Optional
+
+from .maps import Aggregation, DataPointType
+
+
+class WindowAggregator:
+    """
+    Combines the datapoints of each series received within window seconds
+    of the first one. Cumulative counters are sent with their last value and
+    counters with the sum of the values. Gauges use the aggregation given for
+    the metric in aggregations, the last value by default. The datapoints are
+    sent with the timestamp of the last one combined.
+    """
+    def __init__(self, *, window: float, aggregations: Optional[Dict[str, Aggregation]] = None):
+        self.window = window
+        self.aggregations = aggregations or {}
+        self.received = 0
+        self.sent = 0
+        self._deadline = None
+        # (type, metric, id(dimensions)) -> [last datapoint, aggregated value, count]
+        self._series = {}
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def _aggregation(self, dp_type: DataPointType, metric: str) -> Aggregation:
+        if dp_type == DataPointType.counter:
+            return Aggregation.sum
+        if dp_type == DataPointType.cumulative:
+            return Aggregation.last
+        return self.aggregations.get(metric, Aggregation.last)
+
+    def add(self, points: dict, now: Optional[float] = None) -> None:
+        series = self._series
+        for dp_type, dps in points.items():
+            for dp in dps:
+                self.received += 1
+                key = (dp_type, dp["metric"], id(dp["dimensions"]))
+                state = series.get(key)
+                if state is None:
+                    series[key] = [dp, dp["value"], 1]
+                    continue
+
+                value = dp["value"]
+                previous = state[1]
+                state[0] = dp
+                state[2] += 1
+                if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                    state[1] = value
+                    continue
+                aggregation = self._aggregation(dp_type, dp["metric"])
+                if aggregation in (Aggregation.avg, Aggregation.sum):
+                    state[1] = previous + value
+                elif aggregation == Aggregation.min:
+                    state[1] = min(previous, value)
+                elif aggregation == Aggregation.max:
+                    state[1] = max(previous, value)
+                else:
+                    state[1] = value
+
+        if self._deadline is None and series:
+            self._deadline = (time.monotonic() if now is None else now) + self.window
+
+    def remaining(self, now: Optional[float] = None) -> Optional[float]:
+        """Returns the seconds left of the current window, None if there is nothing to send"""
+        if self._deadline is None:
+            return None
+        return max(self._deadline - (time.monotonic() if now is None else now), 0.0)
+
+    def flush(self) -> dict:
+        """Returns the aggregated datapoints and starts a new window"""
+        points = {}
+        for (dp_type, metric, _), (dp, value, count) in self._series.items():
+            if count > 1 and isinstance(value, (int, float)) and self._aggregation(dp_type, metric) == Aggregation.avg:
+                value = value / count
+            if dp_type not in points:
+                points[dp_type] = []
+            points[dp_type].append(dict(dp, value=value))
+            self.sent += 1
+        self._series = {}
+        self._deadline = None
+        return points
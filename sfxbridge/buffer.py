@@ -0,0 +1,150 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Bounded buffer between the http server receiving telegraf metrics
+# and the sender forwarding them to SignalFX
+#
+import asyncio
+from collections import deque
+from enum import Enum
+from threading import Condition
+from typing import Any, List, Optional
+
+
+class OverflowPolicy(str, Enum):
+    drop_oldest = "drop-oldest"
+    drop_newest = "drop-newest"
+    coalesce = "coalesce"
+    reject = "reject"
+
+
+class IngestBuffer:
+    """
+    Buffers received telegraf POSTs for the sender, bounded both by the number
+    of batches and their total size in bytes. When full, the overflow policy
+    determines what happens to the new data:
+
+    drop-oldest: the oldest buffered batches are dropped to make room
+    drop-newest: the new data is dropped
+    coalesce: the new data is appended to the newest buffered batch, so that
+        it is sent with it in a single request. Oldest batches are still
+        dropped if the byte limit would be exceeded
+    reject: the new data is refused, so that the caller can tell telegraf to
+        keep it and retry later
+
+    A batch is always accepted to an empty buffer regardless of its size.
+    """
+    def __init__(self, *, max_batches: int, max_bytes: int, overflow: OverflowPolicy):
+        self.max_batches = max(max_batches, 1)
+        self.max_bytes = max_bytes
+        self.overflow = OverflowPolicy(overflow)
+        self.dropped = 0
+        self.rejected = 0
+        self._batches = deque()
+        self._bytes = 0
+        self._closed = False
+        self._cond = Condition()
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def _full(self, size: int) -> bool:
+        return len(self._batches) >= self.max_batches or self._bytes + size > self.max_bytes
+
+    def _drop_oldest(self) -> None:
+        payloads, size = self._batches.popleft()
+        self._bytes -= size
+        self.dropped += len(payloads)
+
+    def put(self, data: Any, size: int) -> bool:
+        """Add data to the buffer, returns False if the data was not accepted"""
+        with self._cond:
+            if self._closed:
+                return False
+
+            if self._batches and self._full(size):
+                if self.overflow == OverflowPolicy.reject:
+                    self.rejected += 1
+                    return False
+                if self.overflow == OverflowPolicy.drop_newest:
+                    self.dropped += 1
+                    return False
+                if self.overflow == OverflowPolicy.coalesce:
+                    while self._batches and self._bytes + size > self.max_bytes:
+                        self._drop_oldest()
+                    if len(self._batches) >= self.max_batches:
+                        payloads, batch_size = self._batches.pop()
+                        payloads.append(data)
+                        self._batches.append((payloads, batch_size + size))
+                        self._bytes += size
+                        self._notify()
+                        return True
+                while self._batches and self._full(size):
+                    self._drop_oldest()
+
+            self._batches.append(([data], size))
+            self._bytes += size
+            self._notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[List[Any]]:
+        """
+        Returns the oldest batch as list of the data put to it, or None if the
+        buffer has been closed or the timeout expired
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._batches or self._closed, timeout=timeout):
+                return None
+            if self._closed:
+                return None
+            return self._pop()
+
+    def _pop(self) -> List[Any]:
+        payloads, size = self._batches.popleft()
+        self._bytes -= size
+        return payloads
+
+    def _notify(self) -> None:
+        self._cond.notify()
+
+    def close(self) -> None:
+        """Close the buffer and wake up the waiting consumers"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class AsyncIngestBuffer(IngestBuffer):
+    """
+    IngestBuffer for a consumer running in the same asyncio event loop as
+    the http server putting data to it
+    """
+    def __init__(self, *, max_batches: int, max_bytes: int, overflow: OverflowPolicy):
+        super().__init__(max_batches=max_batches, max_bytes=max_bytes, overflow=overflow)
+        # Created on first get() to bind it to the running event loop
+        self._ready = None
+
+    def _notify(self) -> None:
+        if self._ready is not None:
+            self._ready.set()
+
+    async def get(self) -> Optional[List[Any]]:  # pylint: disable=arguments-differ,invalid-overridden-method
+        """Returns the oldest batch as list of the data put to it, or None if the buffer has been closed"""
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while not self._closed:
+            if self._batches:
+                return self._pop()
+            self._ready.clear()
+            await self._ready.wait()
+        return None
+
+    def close(self) -> None:
+        self._closed = True
+        self._notify()
@@ -0,0 +1,185 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Tracking of the number of distinct series per SignalFX metric and
+# enforcing limits for it
+#
+import fnmatch
+import math
+import time
+from enum import Enum
+from typing import Dict, Hashable, List, Optional, Sequence, Set
+
+
+class SeriesLimitPolicy(str, Enum):
+    drop = "drop"
+    fold = "fold"
+
+
+_MASK = (1 << 64) - 1
+_POWERS = [2.0**-rank for rank in range(256)]
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct values added in constant memory, one
+    byte per register. With the default precision (1024 registers) the
+    standard error is about 3%.
+    """
+    def __init__(self, precision: int = 10):
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+        self._rank_bits = 64 - precision
+
+    def add(self, value: Hashable) -> None:
+        # hash() of small ints is the int itself, mix the bits (splitmix64 finalizer)
+        h = hash(value) & _MASK
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK
+        h ^= h >> 31
+        index = h >> self._rank_bits
+        rest = h & ((1 << self._rank_bits) - 1)
+        rank = self._rank_bits - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Adds the values added to the other estimator of the same precision"""
+        self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def count(self) -> int:
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(map(_POWERS.__getitem__, self._registers))
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class SeriesLimiter:
+    """
+    Counts the distinct series of each metric and decides whether new series
+    are admitted. The metrics are limited by glob patterns in limits, metrics
+    not matching any are limited by default_limit, if given.
+
+    With expiry the series are tracked in periods of expiry seconds. Series
+    not seen during a whole period are forgotten and no longer count towards
+    the limits, and the counts are of the series seen within the current and
+    the previous period. Without expiry only the admitted series of limited
+    metrics are remembered, forever, and the counts are since the start.
+    """
+    def __init__(
+        self,
+        *,
+        default_limit: Optional[int] = None,
+        limits: Optional[Dict[str, int]] = None,
+        policy: SeriesLimitPolicy = SeriesLimitPolicy.drop,
+        expiry: Optional[float] = None,
+    ):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.policy = SeriesLimitPolicy(policy)
+        self.expiry = expiry
+        self.limited = 0
+        self._estimators: Dict[str, HyperLogLog] = {}
+        self._previous_estimators: Dict[str, HyperLogLog] = {}
+        self._admitted: Dict[str, Set[Hashable]] = {}
+        self._resolved: Dict[str, Optional[int]] = {}
+        # series -> names of its metrics, of the series seen within the current and the previous period
+        self._seen: Dict[Hashable, Sequence[str]] = {}
+        self._previous_seen: Dict[Hashable, Sequence[str]] = {}
+        self._rotated_at = time.monotonic()
+
+    def _limit(self, name: str) -> Optional[int]:
+        if name not in self._resolved:
+            limit = self.default_limit
+            for pattern, pattern_limit in self.limits.items():
+                if fnmatch.fnmatchcase(name, pattern):
+                    limit = pattern_limit
+                    break
+            self._resolved[name] = limit
+        return self._resolved[name]
+
+    def _estimator(self, name: str) -> HyperLogLog:
+        estimator = self._estimators.get(name)
+        if estimator is None:
+            estimator = self._estimators[name] = HyperLogLog()
+        return estimator
+
+    def admit(self, names: Sequence[str], series: Hashable) -> bool:
+        """
+        Records a series of the given metrics, returns False if any of
+        them has reached its limit and the series is not already admitted
+        """
+        if self.expiry is not None:
+            self._seen[series] = names
+        capped = []
+        admitted = True
+        for name in names:
+            self._estimator(name).add(series)
+            limit = self._limit(name)
+            if limit is None:
+                continue
+            if name not in self._admitted:
+                self._admitted[name] = set()
+            known = self._admitted[name]
+            if series not in known:
+                capped.append(known)
+                if len(known) >= limit:
+                    admitted = False
+
+        if not admitted:
+            self.limited += 1
+            return False
+        for known in capped:
+            known.add(series)
+        return True
+
+    def seen(self, names: Sequence[str], series: Hashable) -> None:
+        """Records that a series already decided on is still active, so that it is not expired"""
+        if self.expiry is None or series in self._seen:
+            return
+        self._seen[series] = names
+        for name in names:
+            self._estimator(name).add(series)
+
+    def expire(self, now: Optional[float] = None) -> List[Hashable]:
+        """
+        Starts a new period once the current one has lasted expiry seconds,
+        forgetting the series not seen during the previous one. Returns the
+        expired series.
+        """
+        if self.expiry is None:
+            return []
+        if now is None:
+            now = time.monotonic()
+        if now - self._rotated_at < self.expiry:
+            return []
+
+        self._rotated_at = now
+        expired = [series for series in self._previous_seen if series not in self._seen]
+        self._previous_seen, self._seen = self._seen, {}
+        self._previous_estimators, self._estimators = self._estimators, {}
+        if expired:
+            for known in self._admitted.values():
+                known.difference_update(expired)
+        return expired
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the estimated number of series for each metric"""
+        counts = {}
+        for name in sorted(set(self._estimators).union(self._previous_estimators)):
+            estimator = self._estimators.get(name)
+            previous = self._previous_estimators.get(name)
+            if estimator is None or previous is None:
+                counts[name] = (estimator or previous).count()
+                continue
+            merged = HyperLogLog(estimator.precision)
+            merged.merge(estimator)
+            merged.merge(previous)
+            counts[name] = merged.count()
+        return counts
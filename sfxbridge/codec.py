@@ -0,0 +1,57 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# JSON encoding and decoding using orjson when it is installed,
+# otherwise the standard library json module
+#
+import json
+import math
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_loads(data: bytes) -> Any:
+    return orjson.loads(data)
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    # Datapoints are keyed by DataPointType
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _json_loads(data: bytes) -> Any:
+    return json.loads(data)
+
+
+def _finite(obj: Any) -> Any:
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _json_dumps(obj: Any) -> bytes:
+    try:
+        return json.dumps(obj, allow_nan=False).encode("utf-8")
+    except ValueError:
+        # NaN and Infinity are not valid JSON, write them as null like orjson does
+        return json.dumps(_finite(obj)).encode("utf-8")
+
+
+if orjson is not None:
+    NAME = "orjson"
+    loads = _orjson_loads
+    dumps = _orjson_dumps
+else:
+    NAME = "json"
+    loads = _json_loads
+    dumps = _json_dumps
@@ -0,0 +1,68 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# JSON encoder for the SignalFX /v2/datapoint ingest API caching the
+# serialized metric name and dimensions of each series, only the value
+# and the timestamp are serialized per datapoint
+#
+import math
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+from . import codec
+
+
+def _encode_value(value: Any) -> bytes:
+    value_type = type(value)
+    if value_type is int:
+        return b"%d" % value
+    if value_type is float and math.isfinite(value):
+        return repr(value).encode("ascii")
+    return codec.dumps(value)
+
+
+class JsonEncoder:
+    def __init__(self, max_series: int = 65536):
+        self.max_series = max_series
+        self.hits = 0
+        self.misses = 0
+        # (metric, id(dimensions)) -> (dimensions, serialized prefix), the dimensions are kept
+        # referenced so that the id can't be reused by another dict while the entry exists
+        self._fragments = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._fragments)
+
+    def _prefix(self, metric: str, dimensions: dict) -> bytes:
+        key = (metric, id(dimensions))
+        entry = self._fragments.get(key)
+        if entry is not None and entry[0] is dimensions:
+            self.hits += 1
+            self._fragments.move_to_end(key)
+            return entry[1]
+
+        self.misses += 1
+        prefix = codec.dumps({"metric": metric, "dimensions": dimensions})[:-1] + b',"value":'
+        self._fragments[key] = (dimensions, prefix)
+        if len(self._fragments) > self.max_series:
+            self._fragments.popitem(last=False)
+        return prefix
+
+    def encode(self, points: dict) -> bytes:
+        """Encode the datapoints to the same JSON document as codec.dumps(points)"""
+        parts = []
+        with self._lock:
+            for dp_type, dps in points.items():
+                fragments = []
+                for dp in dps:
+                    fragment = self._prefix(dp["metric"], dp["dimensions"]) + _encode_value(dp["value"])
+                    timestamp = dp.get("timestamp")
+                    if timestamp is not None:
+                        fragment += b',"timestamp":' + _encode_value(timestamp)
+                    fragments.append(fragment + b"}")
+                parts.append(b'"%s":[%s]' % (dp_type.encode("ascii"), b",".join(fragments)))
+        return b"{" + b",".join(parts) + b"}"
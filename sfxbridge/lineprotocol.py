@@ -0,0 +1,170 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Parser for the influx line protocol, telegraf's "influx" data format:
+#
+#   measurement[,tag=value...] field=value[,field=value...] [timestamp]
+#
+# The metrics are returned in the same form as in telegraf json output,
+# i.e. dict with name, tags, fields and timestamp (in seconds). Lines
+# without escapes or string fields, i.e. almost all of them, are parsed
+# with plain str.partition/split calls.
+#
+import re
+from typing import Iterator, List, Optional, Tuple
+
+_UNESCAPE = re.compile(r"\\([,= \"\\])")
+
+_TRUE = {"t", "T", "true", "True", "TRUE"}
+_FALSE = {"f", "F", "false", "False", "FALSE"}
+
+# Divisors to convert timestamps of given precision to seconds
+PRECISIONS = {
+    "ns": 1000000000,
+    "us": 1000000,
+    "ms": 1000,
+    "s": 1,
+}
+
+
+def _unescape(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _UNESCAPE.sub(r"\1", value)
+
+
+def _split(value: str, separator: str, *, maxsplit: int = -1, quotes: bool = False) -> List[str]:
+    """Split on separators not escaped with backslash (or within double quotes)"""
+    parts = []
+    start = 0
+    i = 0
+    quoted = False
+    length = len(value)
+    while i < length:
+        char = value[i]
+        if char == "\\":
+            i += 2
+            continue
+        if quotes and char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted and maxsplit != len(parts):
+            parts.append(value[start:i])
+            start = i + 1
+        i += 1
+    parts.append(value[start:])
+    return parts
+
+
+def _split_pair(value: str, separator: str) -> Tuple[str, str]:
+    """Split key and value on the first separator not escaped with backslash"""
+    parts = _split(value, separator, maxsplit=1)
+    if len(parts) != 2:
+        raise ValueError(f"Missing {separator!r} in {value!r}")
+    return parts[0], parts[1]
+
+
+def _field_value(value: str):
+    if value[0] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    last = value[-1]
+    if last in "iu":
+        return int(value[:-1])
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    return float(value)
+
+
+def _parse_fields(fields: List[str]) -> dict:
+    result = {}
+    for field in fields:
+        key, value = _split_pair(field, "=")
+        result[_unescape(key)] = _field_value(value)
+    return result
+
+
+def _parse_slow(line: str) -> tuple:
+    """Parse line honouring escapes and quoted string field values"""
+    sections = _split(line, " ", quotes=True)
+    series = _split(sections[0], ",")
+    tags = {}
+    for tag in series[1:]:
+        key, value = _split_pair(tag, "=")
+        tags[_unescape(key)] = _unescape(value)
+    fields = {}
+    for field in _split(sections[1], ",", quotes=True):
+        key, value = _split_pair(field, "=")
+        fields[_unescape(key)] = _field_value(value)
+    return _unescape(series[0]), tags, fields, sections[2:]
+
+
+def parse_line(line: str, *, precision: str = "ns", tag_cache: Optional[dict] = None) -> dict:
+    """
+    Parse single line of line protocol. Metrics parsed with the same tag_cache
+    share the tags dict when their tags are identical.
+    """
+    if "\\" in line or '"' in line:
+        name, tags, fields, rest = _parse_slow(line)
+    else:
+        series, _, rest = line.partition(" ")
+        field_set, _, rest = rest.partition(" ")
+        name, _, tag_set = series.partition(",")
+        tags = tag_cache.get(tag_set) if tag_cache is not None else None
+        if tags is None:
+            tags = dict(tag.split("=", 1) for tag in tag_set.split(",")) if tag_set else {}
+            if tag_cache is not None:
+                tag_cache[tag_set] = tags
+        fields = {}
+        for field in field_set.split(","):
+            key, _, value = field.partition("=")
+            last = value[-1]
+            if last == "i":
+                fields[key] = int(value[:-1])
+            elif last.isdigit():
+                fields[key] = float(value)
+            else:
+                fields[key] = _field_value(value)
+        rest = [rest] if rest else []
+
+    if len(rest) > 1 or (rest and " " in rest[0]):
+        raise ValueError(f"Unexpected data after timestamp: {line!r}")
+    timestamp = None
+    if rest and rest[0]:
+        timestamp = int(rest[0]) // PRECISIONS[precision]
+
+    return {
+        "name": name,
+        "tags": tags,
+        "fields": fields,
+        "timestamp": timestamp,
+    }
+
+
+def parse(body: bytes, *, precision: str = "ns", log=None) -> Iterator[dict]:
+    """
+    Yields the metrics of line protocol body, one per line. With log given,
+    invalid lines are skipped and logged once per body, otherwise the first
+    one raises ValueError.
+    """
+    tag_cache = {}
+    invalid = 0
+    first_error = None
+    for line in body.decode("utf-8").split("\n"):
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        try:
+            metric = parse_line(line, precision=precision, tag_cache=tag_cache)
+        except (IndexError, KeyError, ValueError) as ex:
+            error = ValueError(f"Invalid line {line!r}: {ex!r}")
+            if log is None:
+                raise error from ex
+            invalid += 1
+            first_error = first_error or error
+            continue
+        yield metric
+    if invalid:
+        log.warning("Skipped %d invalid line protocol lines, first: %s", invalid, first_error)
@@ -1,7 +1,59 @@
 # Copyright 2019, Aiven, https://aiven.io/
-from typing import Any, List, Optional, Set
+import fnmatch
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple
 
 from . import maps
+from .cardinality import SeriesLimiter, SeriesLimitPolicy
+from .series import SeriesStore
+
+
+class _FieldRule(NamedTuple):
+    field: str
+    name: str
+    dp_type: maps.DataPointType
+    transform: Optional[maps.Transform] = None
+
+
+class FrozenDimensions(dict):
+    """Immutable dimensions dict, shared by all the datapoints of the same dimensions"""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("FrozenDimensions can not be modified")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+
+# Interned in place of the dimensions of series over their series limit
+_LIMITED = FrozenDimensions()
+
+# Value of the tag dimensions of series folded together when over the limit
+FOLDED_VALUE = "_other"
+
+# Dimensions identifying the source of the metrics, not folded unless they are the only tag dimensions
+_FOLD_KEPT = ("host", "cluster")
+
+
+class _FoldedDimensions(FrozenDimensions):
+    """Dimensions of the series folded together over their series limit"""
+    __slots__ = ()
+
+
+class _DimensionRule(NamedTuple):
+    """
+    Precompiled dimension mapping, static dimensions are resolved once and
+    only the references to telegraf tags need to be looked up per metric
+    """
+    key: int
+    static: FrozenDimensions
+    tags: Tuple[Tuple[str, str], ...]
+    fields: Tuple[_FieldRule, ...]
+    names: Tuple[str, ...]
 
 
 class Mapper:
@@ -13,95 +65,354 @@ class Mapper:
     """
 
     datapoints = None
+    processed_metrics = 0
 
     @classmethod
-    def supported_datapoints(cls: "Mapper", service: Optional[str] = None) -> List[str]:
-        mappings, _ = maps.get_rules(service=service)
+    def supported_datapoints(cls: "Mapper", service: Optional[str] = None,
+                             measurements: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the names of the datapoints mapped, optionally only from the measurements
+        matching the glob patterns, including the ones constructed from those measurements
+        """
+        mappings, constructors = maps.get_rules(service=service)
+
+        def matches(measurement: str) -> bool:
+            return any(fnmatch.fnmatchcase(measurement, p) for p in measurements)
+
+        constructed = set()
+        if measurements is not None:
+            for constructor in constructors:
+                # Constructors not declaring their measurements are given every metric
+                sources = getattr(constructor.Meta, "measurements", None)
+                if sources is None or any(matches(source) for source in sources):
+                    constructed.update(constructor.Meta.mappings)
+
         dps = set()
-        for conversion in mappings.values():
+        for measurement, conversion in mappings.items():
+            if measurements is not None and measurement not in constructed and not matches(measurement):
+                continue
             for dp in conversion.values():
                 dps.add(dp["name"])
         return list(dps)
 
-    def __init__(self, *, log, whitelist: Set[str], service: str):
+    def __init__(
+        self,
+        *,
+        log,
+        whitelist: Set[str],
+        service: str,
+        dimension_cache_size: int = 65536,
+        series_limiter: Optional[SeriesLimiter] = None,
+        series_expiry: float = 600.0,
+    ):
         self.log = log
         self._whitelist = whitelist
-        self._mappings, constructors = maps.get_rules(service=service)
+        self._series_limiter = series_limiter
+        # Previous values of the series with rate or delta transform
+        self._series_store = SeriesStore(expiry=series_expiry)
+        # Dimensions are interned by the rule and the values of the tags it refers to
+        self._dimension_cache = OrderedDict()
+        self._dimension_cache_size = dimension_cache_size
+        self.dimension_cache_hits = 0
+        self.dimension_cache_misses = 0
+        # Folded dimensions are interned by the rule and the kept dimensions, and their
+        # datapoints of the batch being processed by the type, metric and dimensions
+        self._folded_dimensions = {}
+        self._folded_points = {}
+        mappings, constructors = maps.get_rules(service=service)
+        self._plan = self._compile(mappings)
+        self.aggregations = {
+            rule["name"]: rule["aggregation"]
+            for conversion in mappings.values()
+            for rule in conversion.values()
+            if "aggregation" in rule and rule["name"] in whitelist
+        }
         self._collectors = [cls() for cls in constructors]
+        self._dispatch, self._catch_all = self._index_collectors(self._collectors)
         self.clear()
 
+    @staticmethod
+    def _index_collectors(collectors: list) -> Tuple[Dict[str, list], list]:
+        """
+        Index the collectors by the telegraf measurements they declare in
+        Meta.measurements. Collectors not declaring any are given every metric.
+        """
+        dispatch = {}
+        catch_all = []
+        for collector in collectors:
+            measurements = getattr(collector.Meta, "measurements", None)
+            if measurements is None:
+                catch_all.append(collector)
+                continue
+            for measurement in measurements:
+                if measurement not in dispatch:
+                    dispatch[measurement] = []
+                dispatch[measurement].append(collector)
+
+        # Keep the registration order when catch-all collectors are involved
+        if catch_all:
+            for measurement, indexed in dispatch.items():
+                dispatch[measurement] = [c for c in collectors if c in catch_all or c in indexed]
+        return dispatch, catch_all
+
+    def _compile(self, mappings: dict) -> Dict[str, List[_DimensionRule]]:
+        """
+        Compile the conversion table into per measurement plan containing only the
+        whitelisted fields. Fields sharing the same dimension mapping are grouped
+        so that the dimensions are only resolved once per telegraf metric.
+        """
+        plan = {}
+        rule_count = 0
+        for measurement, conversion in mappings.items():
+            groups = {}
+            for field, rule in conversion.items():
+                if rule["name"] not in self._whitelist:
+                    continue
+                spec = tuple(tuple(dimension) for dimension in rule["dimensions"])
+                if spec not in groups:
+                    groups[spec] = []
+                groups[spec].append(
+                    _FieldRule(field=field, name=rule["name"], dp_type=rule["type"], transform=rule.get("transform"))
+                )
+
+            rules = []
+            for spec, fields in groups.items():
+                static = {}
+                tags = []
+                for key, value in spec:
+                    # values starting '$' are references to original metric tags
+                    if value and value[0] == "$":
+                        tags.append((key, value[1:]))
+                    elif value:
+                        static[key] = value
+                    else:
+                        self.log.warning('Unknown dimension "%s" requested', (key, value))
+                rules.append(
+                    _DimensionRule(
+                        key=rule_count,
+                        static=FrozenDimensions(static),
+                        tags=tuple(tags),
+                        fields=tuple(fields),
+                        names=tuple(field.name for field in fields),
+                    )
+                )
+                rule_count += 1
+            if rules:
+                plan[measurement] = rules
+        return plan
+
     def clear(self):
         self.datapoints = {}
+        self._folded_points = {}
+        self.processed_metrics = 0
         for collector in self._collectors:
             collector.clear()
 
-    def process(self, metrics: List[dict]):
+    def process(self, metrics: Iterable[dict]):
+        dispatch = self._dispatch
+        catch_all = self._catch_all
+        count = 0
         for metric in metrics:
+            count += 1
             self._simple_mapping(metric)
-            for collector in self._collectors:
+            for collector in dispatch.get(metric.get("name"), catch_all):
                 collector.process(metric)
 
         for collector in self._collectors:
             for metric in collector.metrics:
                 self._simple_mapping(metric)
 
+        self.processed_metrics += count
+        self._series_store.expire()
+        if self._series_limiter is not None:
+            self._forget_series(self._series_limiter.expire())
+
+    def _forget_series(self, expired: List[Hashable]) -> None:
+        """
+        Drops the cached dimensions of the series expired by the series limiter, and
+        the cached decisions of the series over their limit as there may be room now
+        """
+        if not expired:
+            return
+        cache = self._dimension_cache
+        for key in expired:
+            cache.pop(key, None)
+        refused = [
+            key for key, dimensions in cache.items()
+            if dimensions is _LIMITED or isinstance(dimensions, _FoldedDimensions)
+        ]
+        for key in refused:
+            del cache[key]
+
     def _simple_mapping(self, metric: dict) -> None:
-        name = metric.get("name")
+        rules = self._plan.get(metric.get("name"))
+        if not rules:
+            return
+
         fields = metric.get("fields", {})
         timestamp = metric.get("timestamp")
 
-        conversion = self._mappings.get(name)
-        if not conversion:
-            return
+        for rule in rules:
+            dp_dimensions = None
+            folded = False
+            for field in rule.fields:
+                if field.field not in fields:
+                    continue
 
-        for field, value in fields.items():
-            if field not in conversion:
-                continue
+                if dp_dimensions is None:
+                    dp_dimensions = self._get_dimensions(rule, metric)
+                    if dp_dimensions is _LIMITED:
+                        break
+                    folded = isinstance(dp_dimensions, _FoldedDimensions)
+                value = fields[field.field]
+                if field.transform is not None:
+                    # The series folded together keep their own previous values
+                    series = self._unfolded_series(rule, metric) if folded else dp_dimensions
+                    value = self._transform(field, series, value, timestamp)
+                    if value is None:
+                        continue
+                if folded:
+                    self._fold_datapoint(
+                        dp_type=field.dp_type,
+                        name=field.name,
+                        value=value,
+                        dimensions=dp_dimensions,
+                        timestamp=timestamp,
+                    )
+                else:
+                    self._new_datapoint(
+                        dp_type=field.dp_type,
+                        name=field.name,
+                        value=value,
+                        dimensions=dp_dimensions,
+                        timestamp=timestamp,
+                    )
 
-            dp_name = conversion[field]["name"]
-            if dp_name not in self._whitelist:
-                continue
+    @staticmethod
+    def _unfolded_series(rule: _DimensionRule, metric: dict) -> tuple:
+        tags = metric.get("tags") or {}
+        return (rule.key, tuple(tags.get(tag) for _, tag in rule.tags))
 
-            dp_type = conversion[field]["type"]
-            dp_dimensions = self._get_dimensions(conversion[field]["dimensions"], metric)
-            self._new_datapoint(
-                dp_type=dp_type,
-                name=dp_name,
-                value=value,
-                dimensions=dp_dimensions,
-                timestamp=timestamp,
-            )
+    def _transform(self, field: _FieldRule, series: Hashable, value: Any,
+                   timestamp: Optional[int]) -> Optional[float]:
+        """Derives the rate or delta of a cumulative value of the series, None if not known yet"""
+        if not isinstance(value, (int, float)):
+            self.log.warning("Non-numeric value %r for %s", value, field.name)
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        previous = self._series_store.update((field.name, series), value, timestamp)
+        if previous is None:
+            return None
+        previous_value, previous_timestamp = previous
+        if value < previous_value:
+            # Counter reset, e.g. due to a restart
+            return None
+        if field.transform == maps.Transform.delta:
+            delta = value - previous_value
+            return int(delta) if isinstance(value, int) else delta
+        if timestamp <= previous_timestamp:
+            return None
+        return (value - previous_value) / (timestamp - previous_timestamp)
+
+    @property
+    def series_limiter(self) -> Optional[SeriesLimiter]:
+        return self._series_limiter
+
+    @property
+    def dimension_cache_size(self) -> int:
+        return len(self._dimension_cache)
+
+    def _get_dimensions(self, rule: _DimensionRule, metric: dict) -> FrozenDimensions:
+        if not rule.tags:
+            return rule.static
 
-    def _get_dimensions(self, dimensions: List[str], metric: dict) -> dict:
-        d = {}
         tags = metric.get("tags")
         if not tags:
             self.log.warning("Missing tags for metric %r", metric)
             tags = {}
-        for dimension in dimensions:
-            key = dimension[0]
-            value = dimension[1]
-
-            # values starting '$' are references to origina metric tags
-            if value[0] == "$":
-                value = tags.get(value[1:])
+        values = tuple(tags.get(tag) for _, tag in rule.tags)
+        cache_key = (rule.key, values)
+        dimensions = self._dimension_cache.get(cache_key)
+        if dimensions is not None:
+            self.dimension_cache_hits += 1
+            self._dimension_cache.move_to_end(cache_key)
+            if self._series_limiter is not None:
+                self._series_limiter.seen(rule.names, cache_key)
+            return dimensions
 
+        self.dimension_cache_misses += 1
+        d = dict(rule.static)
+        for (key, tag), value in zip(rule.tags, values):
             if not value:
-                self.log.warning('Unknown dimension "%s" requested', dimension)
+                self.log.warning('Unknown dimension "%s" requested', (key, "$" + tag))
                 continue
 
             d[key] = value
-        return d
+        dimensions = FrozenDimensions(d)
+        if self._series_limiter is not None:
+            # The decision is cached with the dimensions, so it covers all fields of the rule,
+            # not only the ones present in this metric
+            if not self._series_limiter.admit(rule.names, cache_key):
+                dimensions = _LIMITED
+                if self._series_limiter.policy == SeriesLimitPolicy.fold:
+                    dimensions = self._fold_dimensions(rule, d)
+        self._dimension_cache[cache_key] = dimensions
+        if len(self._dimension_cache) > self._dimension_cache_size:
+            self._dimension_cache.popitem(last=False)
+        return dimensions
 
-    def _new_datapoint(
+    def _fold_dimensions(self, rule: _DimensionRule, dimensions: dict) -> FrozenDimensions:
+        """
+        Returns the interned dimensions of the series of the rule folded together,
+        with the tag dimensions other than the source of the metrics set to FOLDED_VALUE
+        """
+        folded = [key for key, _ in rule.tags if key not in _FOLD_KEPT] or [key for key, _ in rule.tags]
+        fold_key = (rule.key, tuple(dimensions.get(key) for key, _ in rule.tags if key not in folded))
+        folded_dimensions = self._folded_dimensions.get(fold_key)
+        if folded_dimensions is None:
+            folded_dimensions = _FoldedDimensions(dimensions, **{key: FOLDED_VALUE for key in folded})
+            self._folded_dimensions[fold_key] = folded_dimensions
+        return folded_dimensions
+
+    def _fold_datapoint(
         self,
         *,
         dp_type: maps.DataPointType,
         name: str,
         value: Any,
-        dimensions: dict,
+        dimensions: FrozenDimensions,
         timestamp: Optional[int] = None,
     ) -> None:
+        """
+        Combines the values of the folded series into a single datapoint per batch with
+        the sum of the values, also for cumulative counters: the sum of the counters of
+        distinct series is again a counter, whichever order they are processed in.
+        Non-numeric values are sent with the last value.
+        """
+        key = (dp_type, name, id(dimensions))
+        dp = self._folded_points.get(key)
+        if dp is None:
+            self._folded_points[key] = self._new_datapoint(
+                dp_type=dp_type, name=name, value=value, dimensions=dimensions, timestamp=timestamp
+            )
+            return
+
+        previous = dp["value"]
+        numeric = isinstance(value, (int, float)) and isinstance(previous, (int, float))
+        dp["value"] = previous + value if numeric else value
+        if timestamp:
+            dp["timestamp"] = timestamp * 1000
+
+    def _new_datapoint(
+        self,
+        *,
+        dp_type: maps.DataPointType,
+        name: str,
+        value: Any,
+        dimensions: FrozenDimensions,
+        timestamp: Optional[int] = None,
+    ) -> dict:
         dp = {
             "metric": name,
             "value": value,
@@ -113,3 +424,4 @@ class Mapper:
         if dp_type not in self.datapoints:
             self.datapoints[dp_type] = []
         self.datapoints[dp_type].append(dp)
+        return dp
@@ -1,5 +1,5 @@
 # Copyright 2019, Aiven, https://aiven.io/
-__all__ = ["host", "kafka", "get_rules", "DataPointType"]
+__all__ = ["host", "kafka", "get_rules", "Aggregation", "DataPointType", "Transform"]
 
 # Import the known mappings to have them registered
 #
@@ -9,9 +9,18 @@ __all__ = ["host", "kafka", "get_rules", "DataPointType"]
 #         "name": "<SIGNALFX_METRICS_NAME>",
 #         "type": DataPointType,
 #         "dimensions": <list-of-dimension-mappings>,
+#         "aggregation": Aggregation,  # optional
+#         "transform": Transform,  # optional
 #     }
 # }
 # Where type can be either gauge, counter or cumulative
+# aggregation determines how the values of a gauge are combined
+# when aggregating over a time window (last, avg, min or max),
+# by default the last value is sent
+# transform derives the sent value from a cumulative telegraf
+# field: rate is the change per second and delta the change
+# since the previous value of the series. Nothing is sent for
+# the first value of a series or after the counter is reset.
 # dimension mapping is a tuple where the first item is
 # the name of the dimension and second item is the value
 # if the value starts with $ it is taken from the field
@@ -25,8 +34,11 @@ __all__ = ["host", "kafka", "get_rules", "DataPointType"]
 # is called and processes using the same mapping rules as
 # before. The class must define the mapping rule in
 # Meta.mapping using the normal mapping rule syntax.
+# The telegraf measurements the constructor consumes should be
+# listed in Meta.measurements, process() is then only called for
+# those metrics. Without it, process() gets every metric.
 #
 from . import host
 from . import kafka
 
-from .metrics import get_rules, DataPointType
+from .metrics import get_rules, Aggregation, DataPointType, Transform
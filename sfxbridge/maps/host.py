@@ -3,7 +3,7 @@
 # mapping rules and constructors for generating the standard
 # host metrics signalfx
 #
-from .metrics import Constructors, DataPointType, Mappings
+from .metrics import Aggregation, Constructors, DataPointType, Mappings
 
 Mappings.register(
     mapping={
@@ -235,12 +235,14 @@ class _CpuUtilization:
     """
 
     class Meta:
+        measurements = {"cpu"}
         mappings = {
             "_constructed_cpu_utilization": {
                 "utilization": {
                     "name": "cpu.utilization",
                     "type": DataPointType.gauge,
                     "dimensions": [("host", "$host"), ("cluster", "$service"), ("plugin", "signalfx-metadata")],
+                    "aggregation": Aggregation.avg,
                 },
             },
         }
@@ -279,6 +281,7 @@ class _NetworkTotal:
     """
 
     class Meta:
+        measurements = {"net"}
         mappings = {
             "_constructed_network_total": {
                 "total": {
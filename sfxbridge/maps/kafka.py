@@ -2,7 +2,7 @@
 #
 # mapping rules and constructors for generating kafka metrics for signalfx
 #
-from .metrics import Constructors, DataPointType, Mappings
+from .metrics import Aggregation, Constructors, DataPointType, Mappings
 
 Mappings.register(
     service="kafka",
@@ -82,6 +82,8 @@ Mappings.register(
                     ("cluster", "$service"),
                     ("hostHasService", "kafka"),
                 ],
+                # Don't hide transient problems within the aggregation window
+                "aggregation": Aggregation.max,
             }
         },
         "kafka.server:ReplicaManager.UnderReplicatedPartitions": {
@@ -93,6 +95,7 @@ Mappings.register(
                     ("cluster", "$service"),
                     ("hostHasService", "kafka"),
                 ],
+                "aggregation": Aggregation.max,
             }
         },
     }
@@ -102,6 +105,7 @@ Mappings.register(
 @Constructors.register(service="kafka")
 class KafkaBytesInOut:
     class Meta:
+        measurements = {"kafka.server:BrokerTopicMetrics.BytesInPerSec", "kafka.server:BrokerTopicMetrics.BytesOutPerSec"}
         mappings = {
             "counter.kafka_bytes": {
                 "in": {
@@ -185,6 +189,7 @@ class KafkaBytesInOut:
 @Constructors.register(service="kafka")
 class KafkaMessagesIn:
     class Meta:
+        measurements = {"kafka.server:BrokerTopicMetrics.MessagesInPerSec"}
         mappings = {
             "_total_kafka_messages_in": {
                 "Count": {
@@ -230,6 +235,7 @@ class KafkaMessagesIn:
 @Constructors.register(service="kafka")
 class RequestMetrics:
     class Meta:
+        measurements = {"kafka.network:RequestMetrics.TotalTimeMs"}
         mappings = {
             "_constructed_kafka_fetch": {
                 "fetch-consumer": {
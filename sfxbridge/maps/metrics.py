@@ -13,6 +13,19 @@ class DataPointType(str, Enum):
     cumulative = "cumulative_counter"
 
 
+class Aggregation(str, Enum):
+    last = "last"
+    avg = "avg"
+    min = "min"
+    max = "max"
+    sum = "sum"
+
+
+class Transform(str, Enum):
+    rate = "rate"
+    delta = "delta"
+
+
 DEFAULT_MAPPING = "__all__"
 
 
@@ -0,0 +1,124 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Hand written encoder for the SignalFX protocol buffer datapoint format
+# accepted by the /v2/datapoint ingest API. The relevant parts of the
+# schema (signal_fx_protocol_buffers.proto) are:
+#
+#   message Datum {
+#     optional string strValue = 1;
+#     optional double doubleValue = 2;
+#     optional int64 intValue = 3;
+#   }
+#   message Dimension {
+#     optional string key = 1;
+#     optional string value = 2;
+#   }
+#   enum MetricType {
+#     GAUGE = 0; COUNTER = 1; ENUM = 2; CUMULATIVE_COUNTER = 3;
+#   }
+#   message DataPoint {
+#     optional string source = 1;
+#     optional string metric = 2;
+#     optional int64 timestamp = 3;
+#     optional Datum value = 4;
+#     optional MetricType metricType = 5;
+#     repeated Dimension dimensions = 6;
+#   }
+#   message DataPointUploadMessage {
+#     repeated DataPoint datapoints = 1;
+#   }
+#
+import struct
+from typing import Any
+
+from .maps import DataPointType
+
+CONTENT_TYPE = "application/x-protobuf"
+
+METRIC_TYPES = {
+    DataPointType.gauge: 0,
+    DataPointType.counter: 1,
+    DataPointType.cumulative: 3,
+}
+
+# Field keys, (field_number << 3) | wire_type
+_DATUM_STR = b"\x0a"
+_DATUM_DOUBLE = b"\x11"
+_DATUM_INT = b"\x18"
+_DIMENSION_KEY = b"\x0a"
+_DIMENSION_VALUE = b"\x12"
+_DATAPOINT_METRIC = b"\x12"
+_DATAPOINT_TIMESTAMP = b"\x18"
+_DATAPOINT_VALUE = b"\x22"
+_DATAPOINT_TYPE = b"\x28"
+_DATAPOINT_DIMENSION = b"\x32"
+_MESSAGE_DATAPOINT = b"\x0a"
+
+_pack_double = struct.Struct("<d").pack
+
+
+def _varint(value: int) -> bytes:
+    if value < 0:
+        value += 1 << 64  # int64 values are encoded as two's complement
+    if value < 0x80:
+        return bytes((value, ))
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _string(key: bytes, value: str) -> bytes:
+    data = value.encode("utf-8")
+    return key + _varint(len(data)) + data
+
+
+def _datum(value: Any) -> bytes:
+    if isinstance(value, bool):
+        return _DATUM_INT + _varint(int(value))
+    if isinstance(value, int):
+        return _DATUM_INT + _varint(value)
+    if isinstance(value, float):
+        return _DATUM_DOUBLE + _pack_double(value)
+    return _string(_DATUM_STR, str(value))
+
+
+def _dimension(key: str, value: str) -> bytes:
+    data = _string(_DIMENSION_KEY, key) + _string(_DIMENSION_VALUE, str(value))
+    return _DATAPOINT_DIMENSION + _varint(len(data)) + data
+
+
+def encode_datapoint(dp: dict, metric_type: int) -> bytes:
+    """Encode single datapoint dict as produced by the Mapper to DataPoint message"""
+    datum = _datum(dp["value"])
+    parts = [
+        _string(_DATAPOINT_METRIC, dp["metric"]),
+        _DATAPOINT_VALUE + _varint(len(datum)) + datum,
+        _DATAPOINT_TYPE + _varint(metric_type),
+    ]
+    timestamp = dp.get("timestamp")
+    if timestamp:
+        parts.append(_DATAPOINT_TIMESTAMP + _varint(timestamp))
+    for key, value in dp["dimensions"].items():
+        parts.append(_dimension(key, value))
+    return b"".join(parts)
+
+
+def encode(points: dict) -> bytes:
+    """Encode the datapoints of the Mapper to DataPointUploadMessage"""
+    out = []
+    for dp_type, dps in points.items():
+        metric_type = METRIC_TYPES[DataPointType(dp_type)]
+        for dp in dps:
+            if dp["value"] is None:
+                continue
+            data = encode_datapoint(dp, metric_type)
+            out.append(_MESSAGE_DATAPOINT)
+            out.append(_varint(len(data)))
+            out.append(data)
+    return b"".join(out)
@@ -0,0 +1,70 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Store for the previous value of series, needed for deriving rates and
+# deltas from cumulative counters
+#
+import time
+from array import array
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class SeriesStore:
+    """
+    Keeps the previous value and timestamp of each series in array-backed
+    slots, the only per series object is the index of its slot. Slots of
+    series not updated within expiry seconds are freed and reused.
+    """
+    def __init__(self, *, expiry: float):
+        self.expiry = expiry
+        self._slots: Dict[Hashable, int] = {}
+        self._free: List[int] = []
+        self._values = array("d")
+        self._timestamps = array("d")
+        self._updated = array("d")
+        self._expired_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def update(self, key: Hashable, value: float, timestamp: float,
+               now: Optional[float] = None) -> Optional[Tuple[float, float]]:
+        """Stores the value of the series, returns the previous value and timestamp if known"""
+        if now is None:
+            now = time.monotonic()
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._values[slot] = value
+                self._timestamps[slot] = timestamp
+                self._updated[slot] = now
+            else:
+                slot = len(self._values)
+                self._values.append(value)
+                self._timestamps.append(timestamp)
+                self._updated.append(now)
+            self._slots[key] = slot
+            return None
+
+        previous = (self._values[slot], self._timestamps[slot])
+        self._values[slot] = value
+        self._timestamps[slot] = timestamp
+        self._updated[slot] = now
+        return previous
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Frees the slots of idle series, at most once per expiry period. Returns the number of expired series."""
+        if now is None:
+            now = time.monotonic()
+        if now - self._expired_at < self.expiry:
+            return 0
+
+        self._expired_at = now
+        updated = self._updated
+        idle = [key for key, slot in self._slots.items() if now - updated[slot] >= self.expiry]
+        for key in idle:
+            self._free.append(self._slots.pop(key))
+        return len(idle)
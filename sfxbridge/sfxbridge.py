@@ -6,18 +6,93 @@
 # sfxbridge receives telegraf metrics via http/out and
 # converts datapoints and sends them to signalfx via the ingres API.
 #
+import asyncio
 import datetime
+import email.utils
 import fnmatch
-import json
+import gzip
 import logging
-from queue import Full, Queue
-from threading import Thread
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from threading import BoundedSemaphore, Event, Lock, Thread
+from typing import Iterator, List, Optional, Tuple
 
+import aiohttp
 import requests
 import systemd.daemon
 from aiohttp import web
+from requests.adapters import HTTPAdapter
 
+from . import codec, egress, lineprotocol, protobuf, stats
+from .aggregate import WindowAggregator
+from .buffer import AsyncIngestBuffer, IngestBuffer, OverflowPolicy
+from .cardinality import SeriesLimiter
 from .mapper import Mapper
+from .maps import DataPointType
+from .spool import Spool
+from .stream import iter_metrics
+from .suppress import GaugeSuppressor
+from .trace import TraceWriter
+from .window import BatchWindow
+
+
+class DataFormat(str, Enum):
+    json = "json"
+    influx = "influx"
+
+
+# Status codes for which sending is retried in addition to 5xx
+RETRYABLE_STATUS = {408, 429}
+
+
+class PostResult(str, Enum):
+    sent = "sent"
+    rejected = "rejected"  # not retried, e.g. invalid data or token
+    failed = "failed"  # could not be sent before the retry deadline
+
+
+def _worse_result(first: PostResult, second: PostResult) -> PostResult:
+    """Returns the worse of the results, failed is worse than rejected which is worse than sent"""
+    order = (PostResult.sent, PostResult.rejected, PostResult.failed)
+    return max(first, second, key=order.index)
+
+
+class _BatchOutcome:
+    """
+    The worst result of the requests of a batch, which share the retry
+    deadline. Once one of them has been given up the rest are not attempted.
+    """
+    def __init__(self, retry_deadline: float):
+        self.deadline = time.monotonic() + retry_deadline
+        self.result = PostResult.sent
+
+    @property
+    def given_up(self) -> bool:
+        return self.result == PostResult.failed
+
+    def add(self, result: PostResult) -> None:
+        self.result = _worse_result(self.result, result)
+
+
+RECEIVED_BATCHES = stats.Counter("sfxbridge_received_batches_total", "Telegraf POSTs received", labels=("format", ))
+RECEIVED_BYTES = stats.Counter("sfxbridge_received_bytes_total", "Bytes of telegraf POSTs received")
+OVERRUNS = stats.Counter(
+    "sfxbridge_buffer_overruns_total", "Telegraf POSTs dropped or rejected due to a full buffer", labels=("policy", )
+)
+DECODE_SECONDS = stats.Histogram("sfxbridge_decode_seconds", "Time spent decoding the telegraf POSTs of a batch")
+PROCESSED_METRICS = stats.Counter("sfxbridge_processed_metrics_total", "Telegraf metrics processed by the mapper")
+MAP_SECONDS = stats.Histogram("sfxbridge_map_seconds", "Time spent mapping a batch to SignalFX datapoints")
+DATAPOINTS = stats.Counter("sfxbridge_datapoints_total", "SignalFX datapoints sent", labels=("type", ))
+ENCODE_SECONDS = stats.Histogram("sfxbridge_encode_seconds", "Time spent encoding a request to SignalFX")
+POST_SECONDS = stats.Histogram("sfxbridge_post_seconds", "Latency of the request attempts to SignalFX")
+POST_ERRORS = stats.Counter(
+    "sfxbridge_post_errors_total", "Failed request attempts to SignalFX, by HTTP status or connection error",
+    labels=("reason", )
+)
+REQUESTS = stats.Counter("sfxbridge_requests_total", "Requests to SignalFX by final result", labels=("result", ))
 
 
 class _HttpServer:
@@ -29,31 +104,64 @@ class _HttpServer:
         self._status = {
             "started": None,
         }
+        self._batches = BatchWindow(self.config.get("status_window", 256))
 
     async def get_status(self, _) -> web.Response:
-        """handler for GET. Returns the current status of the sfxbridge"""
-        return web.json_response(self._status)
+        """
+        handler for GET. Returns the current status of the sfxbridge, and
+        throughput and latency summary of the latest batches in window
+        """
+        return web.json_response({**self._status, "window": self._batches.summary()})
+
+    async def get_metrics(self, _) -> web.Response:
+        """handler for GET /metrics. Returns the internal counters in Prometheus text format"""
+        return web.Response(body=stats.REGISTRY.render().encode("utf-8"), headers={"Content-Type": stats.CONTENT_TYPE})
 
     async def send_metrics(self, request: web.Request) -> web.Response:
-        """handler for POST from telegraf http output
+        """handler for POST from telegraf http output using json data format"""
+        return await self._buffer_metrics(request, DataFormat.json)
+
+    async def send_influx_metrics(self, request: web.Request) -> web.Response:
+        """handler for POST from telegraf http output using influx data format (line protocol)"""
+        return await self._buffer_metrics(request, DataFormat.influx)
 
-        The request body is assumed to be json format, if it is successfully
-        decoded, puts the resulting dict to queue for processing and forwarding
-        to SignalFX by SfxClient. The queue will only buffer on telegraf POST
-        worth of data, if more data is received before the previous has been
-        processed the new data is skipped.
+    async def _buffer_metrics(self, request: web.Request, data_format: DataFormat) -> web.Response:
         """
-        data = await request.json()
-        # If the queue is full just drop the metrics
-        try:
-            request.app["sfx_queue"].put(data, False, 0)
-        except Full:
-            self.log.warning("Overrun, skipping latest metrics")
+        The request body is put to buffer as is, decoding, processing and
+        forwarding to SignalFX is left to SfxClient so that large bodies do
+        not stall the event loop. The buffer is bounded by the number of POSTs
+        and their size, what happens when it is full depends on the configured
+        overflow policy. With the reject policy telegraf is replied with 503 so
+        that it keeps the metrics and retries on its next flush.
+        """
+        body = await request.read()
+        RECEIVED_BATCHES.inc(1, (data_format.value, ))
+        RECEIVED_BYTES.inc(len(body))
+        buffer = request.app["sfx_queue"]
+        dropped = buffer.dropped
+        accepted = buffer.put((data_format, body), len(body))
+        self.update_status("buffered-batches", len(buffer))
+        self.update_status("buffered-bytes", buffer.size)
+        self.update_status("dropped-batches", buffer.dropped)
+        if buffer.dropped != dropped or not accepted:
+            OVERRUNS.inc(1, (OverflowPolicy(buffer.overflow).value, ))
+        if accepted:
+            return web.Response()
+
+        if buffer.overflow == OverflowPolicy.reject:
+            self.update_status("rejected-batches", buffer.rejected)
+            self.log.warning("Overrun, rejecting latest metrics")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        self.log.warning("Overrun, skipping latest metrics")
         return web.Response()
 
     def update_status(self, key, value):
         self._status[key] = value
 
+    def record_batch(self, **batch) -> None:
+        self._batches.record(**batch)
+
 
 class SfxClient:
     def __init__(self, *, config, queue, server):
@@ -65,6 +173,7 @@ class SfxClient:
         self.log = logging.getLogger("SfxClient")
         self.log.setLevel(self.config.get("log_level", "WARNING"))
         self._stop_requested = False
+        self._wakeup = Event()
         self._url = None
         self._realm = self.config.get("realm")
         self._apikey = self.config.get("apikey")
@@ -72,11 +181,59 @@ class SfxClient:
             self._url = f"https://ingest.{self._realm}.signalfx.com/v2/datapoint"
         else:
             self.log.error("No realm given, no metrics will be sent")
-        self._headers = {"Content-Type": "application/json"}
+        self._headers = {}
         if self._apikey:
             self._headers["X-SF-TOKEN"] = self._apikey
         self._timeout = self.config.get("timeout", 20.0)
-        self._trace = self.config.get("trace", False)
+        self._retry_deadline = self.config.get("retry_deadline", 10.0)
+        self._retry_backoff = self.config.get("retry_backoff", 0.5)
+        self._retry_backoff_max = self.config.get("retry_backoff_max", 5.0)
+        self._retries = 0
+        self._give_ups = 0
+        self._max_request_datapoints = self.config.get("max_request_datapoints", 20000)
+        self._max_request_bytes = self.config.get("max_request_bytes", 4 * 1024 * 1024)
+        self._chunked_batches = 0
+        self._spool = None
+        spool_dir = self.config.get("spool_dir")
+        if spool_dir:
+            # relative to the working directory of the service, i.e. /var/lib/sfxbridge
+            self._spool = Spool(
+                path=os.path.abspath(spool_dir),
+                max_bytes=self.config.get("spool_max_bytes", 256 * 1024 * 1024),
+                segment_bytes=self.config.get("spool_segment_bytes", 8 * 1024 * 1024),
+            )
+        self._spool_drain_rate = self.config.get("spool_drain_rate", 2.0)
+        self._drain_tokens = 0.0
+        self._drain_time = time.monotonic()
+        # Datapoints are split by series to max_in_flight lanes each sending
+        # its requests in order, so that the same series is never reordered
+        self._max_in_flight = self.config.get("max_in_flight", 1)
+        self._lanes = None
+        self._in_flight = None
+        self._create_lanes()
+        self._lock = Lock()
+        self._spool_lock = Lock()
+        self._pool_size = max(self.config.get("pool_size", 4), self._max_in_flight)
+        self._pool_idle_timeout = self.config.get("pool_idle_timeout", 60.0)
+        self._session = None
+        self._session_used = 0.0
+        self._connections = {"requests": 0, "connections": 0}
+        self._format = self.config.get("format", "json")
+        if self._format not in {"json", "protobuf"}:
+            self.log.error("Unsupported format %r, using json", self._format)
+            self._format = "json"
+        # Serializing only the values of already seen series beats the standard library json
+        # encoder, but not orjson that encodes the whole batch in native code
+        fragment_cache_size = self.config.get("fragment_cache_size", 65536 if codec.NAME == "json" else 0)
+        self._json_encoder = egress.JsonEncoder(max_series=fragment_cache_size) if fragment_cache_size else None
+        self._compression = self.config.get("compression")
+        if self._compression not in {None, "gzip"}:
+            self.log.error("Unsupported compression %r, sending uncompressed", self._compression)
+            self._compression = None
+        self._compression_level = self.config.get("compression_level", 6)
+        self._compression_min_size = self.config.get("compression_min_size", 1024)
+        self._streaming = self.config.get("streaming", False)
+        self._influx_precision = self.config.get("influx_precision", "ns")
 
         # Whitelist determines which statistics are actually send, even though
         # the configuration has a list of glob patterns
@@ -86,7 +243,49 @@ class SfxClient:
             for dp in fnmatch.filter(datapoints, pattern):
                 self.whitelist.add(dp)
 
-        self._mapper = Mapper(log=self.log, whitelist=self.whitelist, service=self.service)
+        self._mapper = Mapper(
+            log=self.log,
+            whitelist=self.whitelist,
+            service=self.service,
+            dimension_cache_size=self.config.get("dimension_cache_size", 65536),
+            series_limiter=SeriesLimiter(
+                default_limit=self.config.get("series_limit"),
+                limits=self.config.get("series_limits"),
+                policy=self.config.get("series_limit_policy", "drop"),
+                expiry=self.config.get("series_expiry", 600.0),
+            ),
+            series_expiry=self.config.get("series_expiry", 600.0),
+        )
+        self._series_misses = 0
+        # Statistics of the batch being processed, for the status window
+        self._batch_bytes = 0
+        self._map_time = 0.0
+        self._aggregator = None
+        if self.config.get("aggregation_window"):
+            self._aggregator = WindowAggregator(
+                window=self.config["aggregation_window"], aggregations=self._mapper.aggregations
+            )
+        self._suppressor = None
+        if self.config.get("suppress_unchanged_gauges", False):
+            self._suppressor = GaugeSuppressor(heartbeat=self.config.get("suppress_heartbeat", 120.0))
+        self._tracer = None
+        if self.config.get("trace", False):
+            measurements = self.config.get("trace_measurements")
+            self._tracer = TraceWriter(
+                log=self.log,
+                path=self.config.get("trace_file", "trace.json"),
+                sample_rate=self.config.get("trace_sample_rate", 1),
+                measurements=measurements,
+                datapoint_names=set(Mapper.supported_datapoints(service=self.service, measurements=measurements)),
+                max_bytes=self.config.get("trace_max_bytes", 16 * 1024 * 1024),
+                backups=self.config.get("trace_backups", 3),
+                queue_size=self.config.get("trace_queue_size", 16),
+            )
+
+    def _create_lanes(self) -> None:
+        if self._max_in_flight > 1:
+            self._lanes = [ThreadPoolExecutor(max_workers=1) for _ in range(self._max_in_flight)]
+            self._in_flight = BoundedSemaphore(self._max_in_flight)
 
     def stop(self) -> None:
         """Stop the sender (running in a separate thread)"""
@@ -95,72 +294,755 @@ class SfxClient:
             return
 
         self._stop_requested = True
+        self._wakeup.set()
         self.server.update_status("state", "stopping")
         # In case the actual sender thread is waiting for metrics
-        # trigger it by sending empty "metrics"
-        try:
-            self.queue.put({}, False, 0)
-        except Full:
-            pass
+        self.queue.close()
 
     def run(self) -> None:
         """
         Run the sender, this runs as a separate thread (started by
         SfxBridge.run() and basically waits for a telegraf metrics
-        from the queue, converts it to SignalFX datapoint format and
-        sends it to SignalFX via their REST api. There is no retry
-        and send failures result in datapoints being dropped.
+        from the buffer, converts it to SignalFX datapoint format and
+        sends it to SignalFX via their REST api. Failed sends are
+        retried until the retry deadline, after which the datapoints
+        are dropped.
         """
         self.server.update_status("state", "starting")
-        while not self._stop_requested:
-            data = self.queue.get()
+        self.server.update_status("json-codec", codec.NAME)
+        try:
+            while not self._stop_requested:
+                batch = self.queue.get(timeout=self._aggregation_timeout())
+
+                if self._stop_requested or (batch is None and self._aggregator is None):
+                    return
+                try:
+                    if batch is None:
+                        # The aggregation window ended without new metrics
+                        points = self._aggregate(None)
+                        if points is not None:
+                            self.send(points)
+                    else:
+                        self.process(self._decode(batch))
+                except Exception:  # pylint: disable=broad-except
+                    self.log.exception("Failed to process metrics")
+                    self.server.update_status("state", "internal error")
+        finally:
+            if self._aggregator is not None and len(self._aggregator):
+                self.send(self._flush_aggregated())
+            if self._lanes is not None:
+                for lane in self._lanes:
+                    lane.shutdown(wait=True)
+            self._close_session()
+            if self._spool is not None:
+                self._spool.close()
+            if self._tracer is not None:
+                self._tracer.close()
+
+    def _decode(self, batch: list) -> dict:
+        """Decode the received telegraf POSTs, coalesced POSTs are sent as a single request"""
+        self._batch_bytes = sum(len(body) for _, body in batch)
+        if self._streaming:
+            return {"metrics": self._iter_metrics(batch)}
+
+        start = time.perf_counter()
+        data = self._decode_bodies(batch)
+        elapsed = time.perf_counter() - start
+        DECODE_SECONDS.observe(elapsed)
+        self.server.update_status("decode-time", round(elapsed, 6))
+        return data
 
-            if self._stop_requested:
-                return
+    def _decode_bodies(self, batch: list) -> dict:
+        metrics = []
+        for data_format, body in batch:
             try:
-                self.process(data)
-            except Exception:  # pylint: disable=broad-except
-                self.log.exception("Failed to process metrics")
-                self.server.update_status("state", "internal error")
+                if data_format == DataFormat.influx:
+                    data = {"metrics": list(lineprotocol.parse(body, precision=self._influx_precision, log=self.log))}
+                else:
+                    data = codec.loads(body)
+            except ValueError as ex:
+                self.log.warning("Failed to decode received metrics: %r", ex)
+                continue
+            if len(batch) == 1:
+                return data
+            metrics.extend(data.get("metrics", []))
+        return {"metrics": metrics}
+
+    def _iter_metrics(self, batch: list) -> Iterator[dict]:
+        """Yields the metrics of the received telegraf POSTs one at a time while decoding them"""
+        for data_format, body in batch:
+            try:
+                if data_format == DataFormat.influx:
+                    yield from lineprotocol.parse(body, precision=self._influx_precision, log=self.log)
+                else:
+                    yield from iter_metrics(body)
+            except ValueError as ex:
+                self.log.warning("Failed to decode received metrics: %r", ex)
 
     def process(self, data: dict) -> None:
         """Process the telegraf data"""
+        points = self._aggregate(self._map(data))
+        start = time.perf_counter()
+        result = self.send(points) if points is not None else None
+        self._record_batch(points, time.perf_counter() - start, result)
+
+    def _record_batch(self, points: Optional[dict], send_time: float, result: Optional[PostResult]) -> None:
+        self.server.record_batch(
+            received_bytes=self._batch_bytes,
+            metrics=self._mapper.processed_metrics,
+            datapoints=sum(len(dps) for dps in points.values()) if points else 0,
+            map_time=self._map_time,
+            send_time=send_time,
+            result=result,
+        )
+        self._batch_bytes = 0
+        self._map_time = 0.0
+
+    def _aggregation_timeout(self) -> Optional[float]:
+        """Returns how long to wait for new metrics before the aggregation window ends"""
+        if self._aggregator is None:
+            return None
+        return self._aggregator.remaining()
+
+    def _aggregate(self, points: Optional[dict]) -> Optional[dict]:
+        """
+        Adds the datapoints to the aggregation window, returns the aggregated
+        datapoints once the window has ended. Without aggregation the datapoints
+        are returned as they are. Unchanged gauges are suppressed only from the
+        datapoints to send, so that they are still aggregated.
+        """
+        if self._aggregator is None:
+            return self._suppress(points)
+        if points:
+            self._aggregator.add(points)
+        remaining = self._aggregator.remaining()
+        if remaining is None or remaining > 0:
+            return None
+        return self._flush_aggregated()
+
+    def _flush_aggregated(self) -> dict:
+        points = self._aggregator.flush()
+        self.server.update_status("aggregated-datapoints", self._aggregator.received - self._aggregator.sent)
+        return self._suppress(points)
+
+    def _suppress(self, points: Optional[dict]) -> Optional[dict]:
+        if self._suppressor is None or points is None:
+            return points
+        self._suppressor.filter(points)
+        self.server.update_status("suppressed-datapoints", self._suppressor.suppressed)
+        self.server.update_status("suppressed-datapoints-per-minute", self._suppressor.per_minute)
+        return points
+
+    def _map(self, data: dict) -> Optional[dict]:
+        """Map the telegraf data to SignalFX datapoints"""
         try:
             metrics = data["metrics"]
         except KeyError:
             self.log.debug("Received data without metrics")
-            return
+            # Nothing of the previous batch is to be recorded for this one
+            self._mapper.clear()
+            return None
+
+        traced = None
+        if self._tracer is not None and self._tracer.sample():
+            traced = []
+            metrics = self._tracer.collect(metrics, traced)
 
+        start = time.perf_counter()
         self._mapper.clear()
         self._mapper.process(metrics)
-        self.send(self._mapper.datapoints)
+        self._map_time = time.perf_counter() - start
+        MAP_SECONDS.observe(self._map_time)
+        PROCESSED_METRICS.inc(self._mapper.processed_metrics)
+        self._update_mapper_status()
 
-        if self._trace:
-            with open("trace.json", "a") as fp:
-                print("\nTELEGRAF DATA\n", file=fp)
-                json.dump(metrics, fp=fp, indent=2)
-                print("\nDATAPOINTS\n", file=fp)
-                json.dump(self._mapper.datapoints, fp=fp, indent=2)
+        if traced is not None:
+            self._tracer.write(traced, self._mapper.datapoints)
+            self.server.update_status("traced-batches", self._tracer.written)
+            self.server.update_status("trace-dropped-batches", self._tracer.dropped)
 
-    def send(self, points: dict):
-        if not points:
-            self.log.debug("No data")
+        return self._mapper.datapoints
+
+    def _update_mapper_status(self) -> None:
+        mapper = self._mapper
+        lookups = mapper.dimension_cache_hits + mapper.dimension_cache_misses
+        self.server.update_status("dimension-cache-size", mapper.dimension_cache_size)
+        if lookups:
+            self.server.update_status("dimension-cache-hit-rate", round(mapper.dimension_cache_hits / lookups, 4))
+        # New series can only appear with dimensions not found in the cache
+        if mapper.dimension_cache_misses != self._series_misses:
+            self._series_misses = mapper.dimension_cache_misses
+            self.server.update_status("series", mapper.series_limiter.counts())
+            self.server.update_status("series-limited", mapper.series_limiter.limited)
+
+    def _get_session(self) -> requests.Session:
+        """
+        Returns the keep-alive session used for sending, connections idle
+        for longer than pool_idle_timeout are discarded as the server side
+        (or a middlebox) has most likely closed them already.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._session is not None and now - self._session_used > self._pool_idle_timeout:
+                self.log.debug("Connection pool idle for %.1fs, reconnecting", now - self._session_used)
+                self._close_session()
+
+            if self._session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                self._session = requests.Session()
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+                self._session.headers.update(self._headers)
+
+            self._session_used = now
+            return self._session
+
+    def _pool_counts(self) -> dict:
+        """Returns total request and new connection counts for the ingest connection pool"""
+        counts = self._connections.copy()
+        if self._session is not None:
+            pools = self._session.get_adapter(self._url).poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    counts["requests"] += pool.num_requests
+                    counts["connections"] += pool.num_connections
+        return counts
+
+    def _close_session(self) -> None:
+        if self._session is None:
             return
+        self._connections = self._pool_counts()
+        self._session.close()
+        self._session = None
+
+    def _update_connection_status(self) -> None:
+        with self._lock:
+            counts = self._pool_counts()
+        self.server.update_status("connections", counts["connections"])
+        self.server.update_status("connection-reuses", counts["requests"] - counts["connections"])
+
+    @staticmethod
+    def _series_key(dp: dict) -> tuple:
+        return (dp["metric"], sorted(dp["dimensions"].items()))
+
+    def _encode(self, points: dict) -> tuple:
+        """
+        Encode the datapoints to request body, returns the body and the additional
+        headers needed for it. Datapoints of the same series are placed next to
+        each other as that improves the compression ratio considerably.
+        """
+        start = time.perf_counter()
+        if self._compression:
+            for dps in points.values():
+                dps.sort(key=self._series_key)
+
+        if self._format == "protobuf":
+            body = protobuf.encode(points)
+            headers = {"Content-Type": protobuf.CONTENT_TYPE}
+        else:
+            body = self._json_encoder.encode(points) if self._json_encoder else codec.dumps(points)
+            headers = {"Content-Type": "application/json"}
+        if self._compression == "gzip" and len(body) >= self._compression_min_size:
+            body = gzip.compress(body, compresslevel=self._compression_level)
+            headers["Content-Encoding"] = "gzip"
+        elapsed = time.perf_counter() - start
+        ENCODE_SECONDS.observe(elapsed)
+        self.server.update_status("encode-time", round(elapsed, 6))
+        return body, headers
+
+    @staticmethod
+    def _split_chunks(points: dict, count: int) -> List[dict]:
+        """Split the datapoints to count chunks of about equal number of datapoints"""
+        flat = [(dp_type, dp) for dp_type, dps in points.items() for dp in dps]
+        size = -(-len(flat) // count)
+        chunks = []
+        for start in range(0, len(flat), size):
+            chunk = {}
+            for dp_type, dp in flat[start:start + size]:
+                if dp_type not in chunk:
+                    chunk[dp_type] = []
+                chunk[dp_type].append(dp)
+            chunks.append(chunk)
+        return chunks
 
-        if self._url:
+    def _encode_chunks(self, points: dict) -> List[Tuple[bytes, dict]]:
+        """
+        Encode the datapoints to one or more requests, each within the
+        max_request_datapoints and max_request_bytes limits
+        """
+        count = sum(len(dps) for dps in points.values())
+        if count <= self._max_request_datapoints:
+            body, headers = self._encode(points)
+            if len(body) <= self._max_request_bytes or count <= 1:
+                return [(body, headers)]
+            parts = self._split_chunks(points, -(-len(body) // self._max_request_bytes))
+        else:
+            parts = self._split_chunks(points, -(-count // self._max_request_datapoints))
+
+        encoded = []
+        while parts:
+            part = parts.pop(0)
+            body, headers = self._encode(part)
+            part_count = sum(len(dps) for dps in part.values())
+            if len(body) > self._max_request_bytes and part_count > 1:
+                parts[0:0] = self._split_chunks(part, max(-(-len(body) // self._max_request_bytes), 2))
+                continue
+            encoded.append((body, headers))
+
+        with self._lock:
+            self._chunked_batches += 1
+            self.server.update_status("chunked-batches", self._chunked_batches)
+        return encoded
+
+    @staticmethod
+    def _retry_after(headers) -> Optional[float]:
+        """Returns the delay requested by the Retry-After header in seconds, if any"""
+        value = headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Exponential backoff with full jitter, unless the server told how long to wait"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self._retry_backoff_max, self._retry_backoff * 2 ** attempt))
+
+    def _check_response(self, status: int, headers) -> Tuple[Optional[PostResult], Optional[float]]:
+        """
+        Returns the result of the request for the response status, None if the
+        request should be retried, and the delay requested by the server if any
+        """
+        self.server.update_status("http-status", status)
+        if 200 <= status < 300:
+            self.server.update_status("state", "connected")
+            REQUESTS.inc(1, (PostResult.sent.value, ))
+            return PostResult.sent, None
+
+        self.log.warning("Failed to send metric: HTTP %d", status)
+        POST_ERRORS.inc(1, (str(status), ))
+        if status not in RETRYABLE_STATUS and status < 500:
+            self.server.update_status("state", "rejected")
+            REQUESTS.inc(1, (PostResult.rejected.value, ))
+            return PostResult.rejected, None
+        self.server.update_status("state", "disconnected")
+        return None, self._retry_after(headers)
+
+    def _connection_failed(self, ex: Exception) -> None:
+        self.log.warning('Failed to connect "%s" (%r)', self._url, ex)
+        self.server.update_status("state", "disconnected")
+        POST_ERRORS.inc(1, ("connection", ))
+
+    def _request_timeout(self, deadline: Optional[float]) -> float:
+        if deadline is None:
+            return self._timeout
+        return max(min(self._timeout, deadline - time.monotonic()), 0.1)
+
+    def _retry_delay(self, attempt: int, retry_after: Optional[float], deadline: Optional[float]) -> Optional[float]:
+        """
+        Returns the delay before the next attempt or None if the request should
+        be given up, requests without deadline are given up right away
+        """
+        if deadline is None:
+            REQUESTS.inc(1, (PostResult.failed.value, ))
+            return None
+        delay = self._backoff(attempt, retry_after)
+        if self._stop_requested or time.monotonic() + delay >= deadline:
+            REQUESTS.inc(1, (PostResult.failed.value, ))
+            with self._lock:
+                self._give_ups += 1
+                self.server.update_status("give-ups", self._give_ups)
+            return None
+
+        with self._lock:
+            self._retries += 1
+            self.server.update_status("retries", self._retries)
+        return delay
+
+    def _post(self, body: bytes, headers: dict, *, deadline: Optional[float] = None) -> PostResult:
+        """
+        Post the encoded datapoints to SignalFX, retrying on connection errors,
+        429 and 5xx responses until the deadline (monotonic time) is reached.
+        Without deadline the request is attempted only once.
+        """
+        attempt = 0
+        while True:
+            retry_after = None
+            session = self._get_session()
+            start = time.perf_counter()
             try:
-                resp = requests.post(self._url, data=json.dumps(points), headers=self._headers, timeout=self._timeout)
+                resp = session.post(self._url, data=body, headers=headers, timeout=self._request_timeout(deadline))
             except requests.exceptions.RequestException as ex:
-                self.log.warning('Failed to connect "%s" (%r)', self._url, ex)
-                self.server.update_status("state", "disconnected")
-                return
+                self._connection_failed(ex)
+            else:
+                POST_SECONDS.observe(time.perf_counter() - start)
+                result, retry_after = self._check_response(resp.status_code, resp.headers)
+                if result is not None:
+                    return result
+            finally:
+                self._update_connection_status()
 
-            self.server.update_status("http-status", resp.status_code)
-            if resp.status_code not in {200, 204}:
-                self.log.warning("Failed to send metric: %r", resp)
-                self.server.update_status("state", "disconnected")
+            delay = self._retry_delay(attempt, retry_after, deadline)
+            if delay is None:
+                return PostResult.failed
+            self._wakeup.wait(delay)
+            attempt += 1
 
-            self.server.update_status("state", "connected")
+    def send(self, points: dict) -> Optional[PostResult]:
+        """
+        Send the datapoints, returns the worst result of the requests or None
+        if they are sent concurrently by the lanes
+        """
+        if not points:
+            self.log.debug("No data")
+            return None
+
+        if not self._url:
+            return None
+
+        self._count_datapoints(points)
+
+        if self._lanes is None:
+            return self._send_encoded(points)
+
+        for lane, lane_points in enumerate(self._split_lanes(points, len(self._lanes))):
+            if lane_points:
+                self._in_flight.acquire()
+                self._lanes[lane].submit(self._send_lane, lane_points)
+        return None
+
+    @staticmethod
+    def _count_datapoints(points: dict) -> None:
+        for dp_type, dps in points.items():
+            DATAPOINTS.inc(len(dps), (DataPointType(dp_type).value, ))
+
+    @staticmethod
+    def _split_lanes(points: dict, count: int) -> list:
+        """Split the datapoints to count lanes by series"""
+        lanes = [{} for _ in range(count)]
+        for dp_type, dps in points.items():
+            for dp in dps:
+                lane = lanes[hash((dp["metric"], tuple(dp["dimensions"].items()))) % len(lanes)]
+                if dp_type not in lane:
+                    lane[dp_type] = []
+                lane[dp_type].append(dp)
+        return lanes
+
+    def _send_lane(self, points: dict) -> None:
+        try:
+            self._send_encoded(points)
+        except Exception:  # pylint: disable=broad-except
+            self.log.exception("Failed to send metrics")
+            self.server.update_status("state", "internal error")
+        finally:
+            self._in_flight.release()
+
+    def _send_encoded(self, points: dict) -> PostResult:
+        return self._post_chunks(self._encode_chunks(points))
+
+    def _post_chunks(self, chunks: List[Tuple[bytes, dict]]) -> PostResult:
+        """
+        Post the requests of a batch, returns the worst result. The retry
+        deadline is shared by the requests, and once one of them has been
+        given up the rest are not attempted but spooled right away.
+        """
+        outcome = _BatchOutcome(self._retry_deadline)
+        for body, headers in chunks:
+            result = PostResult.failed if outcome.given_up else self._post(body, headers, deadline=outcome.deadline)
+            self._spool_result(result, body, headers)
+            outcome.add(result)
+        return outcome.result
+
+    def _spool_result(self, result: PostResult, body: bytes, headers: dict) -> None:
+        """Spool the failed request, or drain the spool if the request succeeded"""
+        if self._spool is None:
+            return
+        if result == PostResult.sent:
+            # Only one lane drains the spool at a time, the others carry on
+            if self._spool_lock.acquire(blocking=False):
+                try:
+                    self._drain_spool()
+                finally:
+                    self._spool_lock.release()
+        elif result == PostResult.failed:
+            with self._spool_lock:
+                self._spool.append(body, headers)
+                self._update_spool_status()
+
+    def _update_spool_status(self) -> None:
+        self.server.update_status("spooled-bytes", self._spool.size)
+        self.server.update_status("spool-dropped-bytes", self._spool.dropped_bytes)
+
+    def _drain_spool(self) -> None:
+        """
+        Send the spooled requests oldest first, limited to spool_drain_rate
+        requests per second so that the backlog does not hog the sender
+        """
+        self._refill_drain_tokens()
+        while self._drain_tokens >= 1 and not self._stop_requested:
+            record = self._spool.peek()
+            if record is None:
+                break
+            self._drain_tokens -= 1
+            if not self._drained(self._post(*record)):
+                break
+            self._spool.advance()
+        self._update_spool_status()
+
+    def _refill_drain_tokens(self) -> None:
+        """Token bucket of the spooled requests that can be sent, holding up to a second's worth"""
+        now = time.monotonic()
+        self._drain_tokens += (now - self._drain_time) * self._spool_drain_rate
+        self._drain_tokens = min(self._drain_tokens, max(self._spool_drain_rate, 1.0))
+        self._drain_time = now
+
+    def _drained(self, result: PostResult) -> bool:
+        """Returns whether the spooled request is done with, failed ones are kept for the next drain"""
+        if result == PostResult.failed:
+            return False
+        if result == PostResult.rejected:
+            self.log.warning("Dropping spooled request rejected by SignalFX")
+        return True
+
+
+class AsyncSfxClient(SfxClient):
+    """
+    Sender running in the same asyncio event loop as the http server, using
+    aiohttp for sending instead of a separate thread and blocking requests.
+    """
+    def __init__(self, *, config, queue, server):
+        self._lane_tasks = None
+        self._client_session = None
+        self._task = None
+        # Spool file I/O is run in order in a single thread outside the event loop
+        self._spool_executor = None
+        super().__init__(config=config, queue=queue, server=server)
+        self._connection_counts = {"connections": 0, "connection-reuses": 0}
+
+    def _create_lanes(self) -> None:
+        # asyncio primitives are created in run() within the event loop
+        pass
+
+    def stop(self) -> None:
+        """Stop the sender by cancelling its task"""
+        if self._stop_requested:
+            return
+
+        self._stop_requested = True
+        self.server.update_status("state", "stopping")
+        self.queue.close()
+        if self._task is not None:
+            self._task.cancel()
+
+    def _create_client_session(self) -> aiohttp.ClientSession:
+        async def on_connection_create_end(_session, _ctx, _params):
+            self._connection_counts["connections"] += 1
+
+        async def on_connection_reuseconn(_session, _ctx, _params):
+            self._connection_counts["connection-reuses"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=self._pool_idle_timeout)
+        return aiohttp.ClientSession(connector=connector, headers=self._headers, trace_configs=[trace_config])
+
+    def _update_connection_status(self) -> None:
+        for key, value in self._connection_counts.items():
+            self.server.update_status(key, value)
+
+    async def run(self) -> None:  # pylint: disable=invalid-overridden-method
+        """
+        Run the sender as a task in the event loop of the http server, see
+        SfxClient.run(). The task is cancelled on shutdown.
+        """
+        self._task = asyncio.current_task()
+        self.server.update_status("state", "starting")
+        self.server.update_status("json-codec", codec.NAME)
+        self._client_session = self._create_client_session()
+        self._spool_lock = asyncio.Lock()
+        map_executor = ThreadPoolExecutor(max_workers=1)
+        mapping = None
+        if self._spool is not None:
+            self._spool_executor = ThreadPoolExecutor(max_workers=1)
+        if self._max_in_flight > 1:
+            self._lane_tasks = [None] * self._max_in_flight
+            self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        try:
+            while not self._stop_requested:
+                try:
+                    batch = await asyncio.wait_for(self.queue.get(), timeout=self._aggregation_timeout())
+                except asyncio.TimeoutError:
+                    batch = None
+                if self._stop_requested or (batch is None and self._aggregator is None):
+                    return
+                try:
+                    if batch is None:
+                        # The aggregation window ended without new metrics
+                        points = self._aggregate(None)
+                        if points is not None:
+                            await self.send(points)
+                    else:
+                        # Decoding and mapping of large batches would stall the event loop
+                        mapping = map_executor.submit(self._decode_and_map, batch)
+                        points = await asyncio.wrap_future(mapping)
+                        await self._send_and_record(points)
+                except Exception:  # pylint: disable=broad-except
+                    self.log.exception("Failed to process metrics")
+                    self.server.update_status("state", "internal error")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if mapping is not None and not mapping.done():
+                # Cancelled while mapping, it has to finish before the aggregated datapoints are flushed
+                await asyncio.wait([asyncio.wrap_future(mapping)])
+            map_executor.shutdown(wait=False)
+            if self._aggregator is not None and len(self._aggregator):
+                await self.send(self._flush_aggregated())
+            if self._lane_tasks is not None:
+                pending = [task for task in self._lane_tasks if task is not None]
+                if pending:
+                    await asyncio.wait(pending, timeout=self._timeout)
+            await self._client_session.close()
+            if self._spool is not None:
+                await self._run_spool_io(self._spool.close)
+                self._spool_executor.shutdown(wait=True)
+            if self._tracer is not None:
+                self._tracer.close()
+
+    async def _run_spool_io(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._spool_executor, fn, *args)
+
+    async def _encode_chunks_async(self, points: dict) -> List[Tuple[bytes, dict]]:
+        """Encoding and compressing large batches would stall the event loop"""
+        return await asyncio.get_event_loop().run_in_executor(None, self._encode_chunks, points)
+
+    def _decode_and_map(self, batch: list) -> Optional[dict]:
+        return self._aggregate(self._map(self._decode(batch)))
+
+    async def process(self, data: dict) -> None:  # pylint: disable=invalid-overridden-method
+        """Process the telegraf data"""
+        await self._send_and_record(self._aggregate(self._map(data)))
+
+    async def _send_and_record(self, points: Optional[dict]) -> None:
+        start = time.perf_counter()
+        result = await self.send(points) if points is not None else None
+        self._record_batch(points, time.perf_counter() - start, result)
+
+    async def send(self, points: dict) -> Optional[PostResult]:  # pylint: disable=invalid-overridden-method
+        if not points:
+            self.log.debug("No data")
+            return None
+
+        if not self._url:
+            return None
+
+        self._count_datapoints(points)
+
+        if self._lane_tasks is None:
+            return await self._send_encoded(points)
+
+        for lane, lane_points in enumerate(self._split_lanes(points, len(self._lane_tasks))):
+            if lane_points:
+                await self._in_flight.acquire()
+                self._lane_tasks[lane] = asyncio.ensure_future(self._send_lane(self._lane_tasks[lane], lane_points))
+        return None
+
+    async def _send_lane(  # pylint: disable=arguments-differ,invalid-overridden-method
+        self, previous: Optional[asyncio.Future], points: dict
+    ) -> None:
+        try:
+            chunks = await self._encode_chunks_async(points)
+            # Requests of the same lane are sent in order
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self._post_chunks(chunks)
+        except Exception:  # pylint: disable=broad-except
+            self.log.exception("Failed to send metrics")
+            self.server.update_status("state", "internal error")
+        finally:
+            self._in_flight.release()
+
+    async def _send_encoded(self, points: dict) -> PostResult:  # pylint: disable=invalid-overridden-method
+        return await self._post_chunks(await self._encode_chunks_async(points))
+
+    async def _post_chunks(  # pylint: disable=invalid-overridden-method
+        self, chunks: List[Tuple[bytes, dict]]
+    ) -> PostResult:
+        """See SfxClient._post_chunks()"""
+        outcome = _BatchOutcome(self._retry_deadline)
+        for body, headers in chunks:
+            if outcome.given_up:
+                result = PostResult.failed
+            else:
+                result = await self._post(body, headers, deadline=outcome.deadline)
+            await self._spool_result(result, body, headers)
+            outcome.add(result)
+        return outcome.result
+
+    async def _spool_result(  # pylint: disable=invalid-overridden-method
+        self, result: PostResult, body: bytes, headers: dict
+    ) -> None:
+        if self._spool is None:
+            return
+        if result == PostResult.sent:
+            if not self._spool_lock.locked():
+                async with self._spool_lock:
+                    await self._drain_spool()
+        elif result == PostResult.failed:
+            # Appending may remove the oldest request another lane is draining
+            async with self._spool_lock:
+                await self._run_spool_io(self._spool.append, body, headers)
+                await self._run_spool_io(self._update_spool_status)
+
+    async def _drain_spool(self) -> None:  # pylint: disable=invalid-overridden-method
+        """See SfxClient._drain_spool()"""
+        self._refill_drain_tokens()
+        while self._drain_tokens >= 1 and not self._stop_requested:
+            record = await self._run_spool_io(self._spool.peek)
+            if record is None:
+                break
+            self._drain_tokens -= 1
+            if not self._drained(await self._post(*record)):
+                break
+            await self._run_spool_io(self._spool.advance)
+        await self._run_spool_io(self._update_spool_status)
+
+    async def _post(  # pylint: disable=invalid-overridden-method
+        self, body: bytes, headers: dict, *, deadline: Optional[float] = None
+    ) -> PostResult:
+        """See SfxClient._post()"""
+        attempt = 0
+        while True:
+            retry_after = None
+            timeout = aiohttp.ClientTimeout(total=self._request_timeout(deadline))
+            start = time.perf_counter()
+            try:
+                async with self._client_session.post(self._url, data=body, headers=headers, timeout=timeout) as resp:
+                    await resp.read()
+                    POST_SECONDS.observe(time.perf_counter() - start)
+                    result, retry_after = self._check_response(resp.status, resp.headers)
+                    if result is not None:
+                        return result
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                self._connection_failed(ex)
+            finally:
+                self._update_connection_status()
+
+            delay = self._retry_delay(attempt, retry_after, deadline)
+            if delay is None:
+                return PostResult.failed
+            await asyncio.sleep(delay)
+            attempt += 1
 
 
 class SfxBridge:
@@ -171,16 +1053,30 @@ class SfxBridge:
         server = _HttpServer(config=config)
         server.update_status("started", datetime.datetime.utcnow().isoformat())
 
-        queue = Queue(maxsize=1)
-        sfx_client = SfxClient(config=config, queue=queue, server=server)
+        self._sender = self.config.get("sender", "thread")
+        if self._sender == "asyncio":
+            buffer_class, client_class = AsyncIngestBuffer, AsyncSfxClient
+        else:
+            buffer_class, client_class = IngestBuffer, SfxClient
+        queue = buffer_class(
+            max_batches=self.config.get("buffer_batches", 4),
+            max_bytes=self.config.get("buffer_bytes", 64 * 1024 * 1024),
+            overflow=self.config.get("buffer_overflow", OverflowPolicy.reject),
+        )
+        sfx_client = client_class(config=config, queue=queue, server=server)
 
-        self._client = Thread(target=sfx_client.run)
+        self._client = None
+        if self._sender != "asyncio":
+            self._client = Thread(target=sfx_client.run)
 
-        self.app = web.Application()
+        self.app = web.Application(client_max_size=self.config.get("max_body_bytes", 1024 * 1024))
         self.app.add_routes([
             web.get("/", server.get_status),
+            web.get("/metrics", server.get_metrics),
             web.post("/", server.send_metrics),
             web.put("/", server.send_metrics),
+            web.post("/influx", server.send_influx_metrics),
+            web.put("/influx", server.send_influx_metrics),
         ])
 
         self.app["sfx_queue"] = queue
@@ -193,15 +1089,26 @@ class SfxBridge:
 
             self.app.on_startup.append(systemd_daemon_notify)
 
+        if self._client is None:
+
+            async def start_sender(app):
+                app["sfx_task"] = asyncio.ensure_future(app["sfx_client"].run())
+
+            self.app.on_startup.append(start_sender)
+
         async def stop_sender(app):
             app["sfx_client"].stop()
+            if "sfx_task" in app:
+                await app["sfx_task"]
 
         self.app.on_shutdown.append(stop_sender)
 
     def run(self):
-        self._client.start()
+        if self._client is not None:
+            self._client.start()
         web.run_app(self.app, host=self.config["host"], port=self.config["port"], access_log=None)
-        self._client.join()
+        if self._client is not None:
+            self._client.join()
 
     @classmethod
     def run_exit(cls, config):
@@ -0,0 +1,125 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# On-disk spool for requests that could not be sent to SignalFX
+#
+import json
+import os
+import struct
+from typing import Optional, Tuple
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".spool"
+
+# Record is the length of the json encoded headers and the body followed by them
+_RECORD_HEADER = struct.Struct(">II")
+
+
+class Spool:
+    """
+    Append-only log of already encoded requests (body and headers), split to
+    segment files of roughly segment_bytes. Records are read back oldest first
+    and fully read segments are removed. When the spool grows over max_bytes
+    the oldest segments are dropped.
+
+    The read position is only kept in memory, after a restart the partially
+    read oldest segment is sent again from its beginning.
+    """
+    def __init__(self, *, path: str, max_bytes: int, segment_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.dropped_bytes = 0
+        os.makedirs(self.path, exist_ok=True)
+
+        self._sizes = {}
+        for name in os.listdir(self.path):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                seq = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                self._sizes[seq] = os.path.getsize(self._segment_path(seq))
+        self._segments = sorted(self._sizes)
+        self._read_offset = 0
+        self._peek_length = 0
+        # Recovered segments may end in a partial record, so always start a new one for writing
+        self._writer = None
+        self._write_seq = None
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    @property
+    def size(self) -> int:
+        """Number of bytes not yet read from the spool"""
+        return sum(self._sizes.values()) - self._read_offset
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._write_seq = None
+
+    def _remove_oldest(self) -> None:
+        seq = self._segments.pop(0)
+        if seq == self._write_seq:
+            self._close_writer()
+        os.unlink(self._segment_path(seq))
+        del self._sizes[seq]
+        self._read_offset = 0
+
+    def append(self, body: bytes, headers: dict) -> None:
+        if self._writer is None or self._sizes[self._write_seq] >= self.segment_bytes:
+            self._close_writer()
+            self._write_seq = self._segments[-1] + 1 if self._segments else 0
+            self._writer = open(self._segment_path(self._write_seq), "ab")
+            self._segments.append(self._write_seq)
+            self._sizes[self._write_seq] = 0
+
+        encoded_headers = json.dumps(headers).encode("utf-8")
+        record = _RECORD_HEADER.pack(len(encoded_headers), len(body)) + encoded_headers + body
+        self._writer.write(record)
+        self._writer.flush()
+        self._sizes[self._write_seq] += len(record)
+
+        while len(self._segments) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            self.dropped_bytes += self._sizes[self._segments[0]] - self._read_offset
+            self._remove_oldest()
+
+    def _read(self, seq: int, offset: int) -> Optional[Tuple[bytes, dict, int]]:
+        with open(self._segment_path(seq), "rb") as fp:
+            fp.seek(offset)
+            header = fp.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return None
+            headers_length, body_length = _RECORD_HEADER.unpack(header)
+            encoded_headers = fp.read(headers_length)
+            body = fp.read(body_length)
+            if len(encoded_headers) < headers_length or len(body) < body_length:
+                return None  # partially written record
+        return body, json.loads(encoded_headers), _RECORD_HEADER.size + headers_length + body_length
+
+    def peek(self) -> Optional[Tuple[bytes, dict]]:
+        """Returns the oldest unread record as (body, headers) without removing it"""
+        while self._segments:
+            record = self._read(self._segments[0], self._read_offset)
+            if record is not None:
+                body, headers, self._peek_length = record
+                return body, headers
+            if self._segments[0] == self._write_seq:
+                return None
+            self._remove_oldest()
+        return None
+
+    def advance(self) -> None:
+        """Remove the record returned by peek()"""
+        self._read_offset += self._peek_length
+        self._peek_length = 0
+        if self._segments and self._read_offset >= self._sizes[self._segments[0]]:
+            self._remove_oldest()
+
+    def close(self) -> None:
+        self._close_writer()
@@ -0,0 +1,99 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Incremental parser for telegraf json batches
+#
+import codecs
+import json
+import re
+from typing import Any, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = re.compile(r"[0-9.eE+\-]*")
+
+
+class _Reader:
+    """Decodes the body to text chunk at a time, keeping only the unparsed part in memory"""
+    def __init__(self, body: bytes, chunk_size: int):
+        self._body = memoryview(body)
+        self._chunk_size = chunk_size
+        self._offset = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+
+    def more(self) -> bool:
+        if self._offset >= len(self._body):
+            return False
+        chunk = self._body[self._offset:self._offset + self._chunk_size]
+        self._offset += len(chunk)
+        self.text = self.text[self.pos:] + self._decoder.decode(chunk, final=self._offset >= len(self._body))
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character or empty string at the end of the body"""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+                continue
+            # A number followed only by number characters up to the end of the chunk, e.g.
+            # "1." of "1.25", may continue in the next one
+            if (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and _NUMBER_CHARS.match(self.text, end).end() == len(self.text) and self.more()
+            ):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_metrics(body: bytes, *, chunk_size: int = 64 * 1024) -> Iterator[dict]:
+    """
+    Yields the metrics of telegraf json batch ({"metrics": [...]}) one at a time
+    without decoding the whole body to objects first
+    """
+    reader = _Reader(body, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key != "metrics":
+            reader.value()
+        else:
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.peek() == "]":
+                        reader.pos += 1
+                        break
+                    reader.expect(",")
+        if reader.peek() == "}":
+            return
+        reader.expect(",")
@@ -0,0 +1,70 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Suppression of gauge datapoints whose value has not changed since
+# it was last sent
+#
+import time
+from typing import Optional
+
+from .maps import DataPointType
+
+
+class GaugeSuppressor:
+    """
+    Drops gauge datapoints with the same value as the one last sent for the
+    series, unless it was sent longer than heartbeat seconds ago. Series are
+    identified by the metric and the interned dimensions object, which is kept
+    referenced so that its id can't be reused. The state of series not sent
+    within the heartbeat is useless and expired.
+    """
+    def __init__(self, *, heartbeat: float):
+        self.heartbeat = heartbeat
+        self.suppressed = 0
+        self.per_minute = 0.0
+        # (metric, id(dimensions)) -> (dimensions, value, sent at)
+        self._series = {}
+        self._expired_at = time.monotonic()
+        self._window_start = self._expired_at
+        self._window_suppressed = 0
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def filter(self, points: dict, now: Optional[float] = None) -> None:
+        """Removes the unchanged gauges from the datapoints in place"""
+        if now is None:
+            now = time.monotonic()
+        gauges = points.get(DataPointType.gauge)
+        if gauges:
+            series = self._series
+            heartbeat = self.heartbeat
+            kept = []
+            for dp in gauges:
+                dimensions = dp["dimensions"]
+                value = dp["value"]
+                key = (dp["metric"], id(dimensions))
+                state = series.get(key)
+                if state is not None and state[0] is dimensions and state[1] == value and now - state[2] < heartbeat:
+                    continue
+                series[key] = (dimensions, value, now)
+                kept.append(dp)
+
+            suppressed = len(gauges) - len(kept)
+            self.suppressed += suppressed
+            self._window_suppressed += suppressed
+            if kept:
+                points[DataPointType.gauge] = kept
+            else:
+                del points[DataPointType.gauge]
+
+        if now - self._expired_at >= self.heartbeat:
+            self._expired_at = now
+            self._series = {key: state for key, state in self._series.items() if now - state[2] < self.heartbeat}
+
+        if now - self._window_start >= 60:
+            self.per_minute = round(self._window_suppressed * 60 / (now - self._window_start), 1)
+            self._window_start = now
+            self._window_suppressed = 0
@@ -0,0 +1,157 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Trace of sampled telegraf batches and the datapoints mapped from them,
+# written to a size limited file by a background thread
+#
+import fnmatch
+import os
+import queue
+import time
+from threading import Lock, Thread
+from typing import Iterable, Iterator, List, Optional, Set
+
+from . import codec
+
+
+class TraceWriter:
+    """
+    Traces one in sample_rate batches, and only the telegraf metrics whose
+    measurement matches one of the measurements glob patterns, if given.
+    Each traced batch is written as a single line of compact json with the
+    traced metrics and the datapoints; with measurements given only the
+    datapoints in datapoint_names are included.
+
+    Encoding and writing is done by a background thread, batches are dropped
+    rather than waited for when queue_size batches are already queued. The
+    file is rotated like logging.handlers.RotatingFileHandler does when it
+    would grow over max_bytes, keeping backups older files.
+    """
+    def __init__(
+        self,
+        *,
+        log,
+        path: str,
+        sample_rate: int = 1,
+        measurements: Optional[List[str]] = None,
+        datapoint_names: Optional[Set[str]] = None,
+        max_bytes: int = 16 * 1024 * 1024,
+        backups: int = 3,
+        queue_size: int = 16,
+    ):
+        self.log = log
+        self.path = path
+        self.sample_rate = max(sample_rate, 1)
+        self.measurements = measurements
+        self.datapoint_names = datapoint_names if measurements else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._batches = 0
+        self._matches = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = Lock()
+        self._thread = None
+        self._fp = None
+        self._size = 0
+
+    def sample(self) -> bool:
+        """Returns whether the next batch is to be traced"""
+        self._batches += 1
+        return (self._batches - 1) % self.sample_rate == 0
+
+    def _matches_measurement(self, name: Optional[str]) -> bool:
+        matches = self._matches.get(name)
+        if matches is None:
+            matches = any(fnmatch.fnmatchcase(name or "", pattern) for pattern in self.measurements)
+            self._matches[name] = matches
+        return matches
+
+    def collect(self, metrics: Iterable[dict], traced: list) -> Iterator[dict]:
+        """Yields the metrics, appending the ones to trace to traced, so that streamed metrics are not materialized"""
+        if self.measurements is None:
+            for metric in metrics:
+                traced.append(metric)
+                yield metric
+        else:
+            for metric in metrics:
+                if self._matches_measurement(metric.get("name")):
+                    traced.append(metric)
+                yield metric
+
+    def write(self, metrics: list, datapoints: dict) -> None:
+        """Queues the batch for writing, nothing is written for batches without traced metrics"""
+        if not metrics:
+            return
+        # The sender may reorder the datapoint lists while the trace is written
+        record = (time.time(), metrics, {dp_type: list(dps) for dp_type, dps in datapoints.items()})
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="trace-writer", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Writes the already queued batches and stops the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                try:
+                    self._write(self._encode(*record))
+                except Exception:  # pylint: disable=broad-except
+                    self.log.exception("Failed to write trace")
+                    self.dropped += 1
+        finally:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+    def _encode(self, timestamp: float, metrics: list, datapoints: dict) -> bytes:
+        if self.datapoint_names is not None:
+            names = self.datapoint_names
+            datapoints = {
+                dp_type: [dp for dp in dps if dp["metric"] in names]
+                for dp_type, dps in datapoints.items()
+            }
+        return codec.dumps({"time": timestamp, "metrics": metrics, "datapoints": datapoints}) + b"\n"
+
+    def _write(self, line: bytes) -> None:
+        if self._fp is None:
+            self._fp = open(self.path, "ab")
+            self._size = self._fp.tell()
+        if self._size and self._size + len(line) > self.max_bytes:
+            self._rotate()
+        self._fp.write(line)
+        self._fp.flush()
+        self._size += len(line)
+        self.written += 1
+
+    def _rotate(self) -> None:
+        self._fp.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+        self._fp = open(self.path, "ab")
+        self._size = 0
+        self.rotations += 1
@@ -0,0 +1,89 @@
+# Copyright 2019, Aiven, https://aiven.io/
+#
+# This file is under the Apache License, Version 2.0.
+# See the file `LICENSE` for details.
+#
+# Rolling window of the latest processed batches, summarized on the
+# status endpoint
+#
+import time
+from array import array
+from typing import Optional
+
+# Result codes stored per batch, unknown is used when the batch was not sent
+# synchronously, e.g. it was aggregated or handed over to concurrent senders
+RESULT_UNKNOWN = 0
+RESULT_SENT = 1
+RESULT_REJECTED = 2
+RESULT_FAILED = 3
+_RESULT_CODES = {"sent": RESULT_SENT, "rejected": RESULT_REJECTED, "failed": RESULT_FAILED}
+
+
+def _percentile(values: list, fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class BatchWindow:
+    """
+    Ring buffer of the statistics of the latest size batches. The slots are
+    preallocated arrays overwritten in place, so recording a batch does not
+    allocate anything. The summary is computed only when requested.
+    """
+    def __init__(self, size: int = 256):
+        self.size = max(size, 1)
+        self.count = 0
+        self._received_bytes = array("d", [0.0]) * self.size
+        self._metrics = array("d", [0.0]) * self.size
+        self._datapoints = array("d", [0.0]) * self.size
+        self._map_time = array("d", [0.0]) * self.size
+        self._send_time = array("d", [0.0]) * self.size
+        self._recorded_at = array("d", [0.0]) * self.size
+        self._results = bytearray(self.size)
+
+    def record(
+        self,
+        *,
+        received_bytes: int,
+        metrics: int,
+        datapoints: int,
+        map_time: float,
+        send_time: float,
+        result: Optional[str],
+        now: Optional[float] = None,
+    ) -> None:
+        slot = self.count % self.size
+        self._received_bytes[slot] = received_bytes
+        self._metrics[slot] = metrics
+        self._datapoints[slot] = datapoints
+        self._map_time[slot] = map_time
+        self._send_time[slot] = send_time
+        self._recorded_at[slot] = time.monotonic() if now is None else now
+        self._results[slot] = _RESULT_CODES.get(result, RESULT_UNKNOWN)
+        self.count += 1
+
+    def summary(self, now: Optional[float] = None) -> dict:
+        filled = min(self.count, self.size)
+        if not filled:
+            return {"batches": 0}
+
+        if now is None:
+            now = time.monotonic()
+        oldest = min(self._recorded_at[:filled])
+        elapsed = max(now - oldest, 1.0)
+        map_times = sorted(self._map_time[:filled])
+        send_times = sorted(self._send_time[:filled])
+        results = self._results[:filled]
+        known = filled - results.count(RESULT_UNKNOWN)
+        dropped = results.count(RESULT_REJECTED) + results.count(RESULT_FAILED)
+        return {
+            "batches": filled,
+            "seconds": round(elapsed, 3),
+            "received-bytes": int(sum(self._received_bytes[:filled])),
+            "metrics-per-second": round(sum(self._metrics[:filled]) / elapsed, 1),
+            "datapoints-per-second": round(sum(self._datapoints[:filled]) / elapsed, 1),
+            "map-time-p50": round(_percentile(map_times, 0.5), 6),
+            "map-time-p99": round(_percentile(map_times, 0.99), 6),
+            "send-time-p50": round(_percentile(send_times, 0.5), 6),
+            "send-time-p99": round(_percentile(send_times, 0.99), 6),
+            "drop-rate": round(dropped / known, 4) if known else None,
+        }
@@ -0,0 +1,59 @@
+# Copyright 2019, Aiven, https://aiven.io/
+from sfxbridge.aggregate import WindowAggregator
+from sfxbridge.mapper import FrozenDimensions
+from sfxbridge.maps.metrics import Aggregation, DataPointType
+
+HOST_A = FrozenDimensions({"host": "a"})
+HOST_B = FrozenDimensions({"host": "b"})
+
+
+def _points(timestamp, offset):
+    return {
+        DataPointType.gauge: [
+            {"metric": "load.midterm", "value": offset, "dimensions": HOST_A, "timestamp": timestamp},
+            {"metric": "load.midterm", "value": offset + 1, "dimensions": HOST_B, "timestamp": timestamp},
+            {"metric": "cpu.utilization", "value": offset, "dimensions": HOST_A, "timestamp": timestamp},
+            {"metric": "gauge.kafka-offline-partitions-count", "value": offset % 3, "dimensions": HOST_A, "timestamp": timestamp},
+        ],
+        DataPointType.counter: [
+            {"metric": "network.total", "value": offset, "dimensions": HOST_A, "timestamp": timestamp},
+        ],
+        DataPointType.cumulative: [
+            {"metric": "if_octets.rx", "value": 100 + offset, "dimensions": HOST_A, "timestamp": timestamp},
+        ],
+    }
+
+
+def test_window_aggregation():
+    aggregator = WindowAggregator(
+        window=60,
+        aggregations={
+            "cpu.utilization": Aggregation.avg,
+            "gauge.kafka-offline-partitions-count": Aggregation.max,
+        },
+    )
+    assert aggregator.remaining() is None
+
+    for offset in range(6):
+        aggregator.add(_points(1570444470000 + offset * 10000, offset), now=100 + offset * 10)
+    assert aggregator.remaining(now=150) == 10
+    assert aggregator.remaining(now=170) == 0
+
+    def values(points, dp_type):
+        return [(dp["metric"], dp["dimensions"]["host"], dp["value"]) for dp in points[dp_type]]
+
+    points = aggregator.flush()
+    assert values(points, DataPointType.gauge) == [
+        ("load.midterm", "a", 5),
+        ("load.midterm", "b", 6),
+        ("cpu.utilization", "a", 2.5),
+        ("gauge.kafka-offline-partitions-count", "a", 2),
+    ]
+    assert values(points, DataPointType.counter) == [("network.total", "a", 15)]
+    assert values(points, DataPointType.cumulative) == [("if_octets.rx", "a", 105)]
+    assert all(dp["timestamp"] == 1570444520000 for dps in points.values() for dp in dps)
+    assert aggregator.received == 36
+    assert aggregator.sent == 6
+
+    assert len(aggregator) == 0
+    assert aggregator.remaining() is None
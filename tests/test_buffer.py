@@ -0,0 +1,94 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import asyncio
+import threading
+
+from sfxbridge.buffer import AsyncIngestBuffer, IngestBuffer, OverflowPolicy
+
+
+def test_reject():
+    buffer = IngestBuffer(max_batches=2, max_bytes=100, overflow=OverflowPolicy.reject)
+    assert buffer.put("a", 10)
+    assert buffer.put("b", 10)
+    assert not buffer.put("c", 10)
+    assert buffer.rejected == 1
+    assert buffer.get() == ["a"]
+    assert buffer.put("c", 10)
+    assert buffer.get() == ["b"]
+    assert buffer.get() == ["c"]
+
+
+def test_drop_oldest():
+    buffer = IngestBuffer(max_batches=2, max_bytes=100, overflow=OverflowPolicy.drop_oldest)
+    assert buffer.put("a", 10)
+    assert buffer.put("b", 10)
+    assert buffer.put("c", 10)
+    assert buffer.dropped == 1
+    assert buffer.put("d", 90)
+    assert buffer.dropped == 2
+    assert buffer.put("e", 20)
+    assert buffer.dropped == 4
+    assert buffer.get() == ["e"]
+    assert buffer.size == 0
+
+
+def test_drop_newest():
+    buffer = IngestBuffer(max_batches=1, max_bytes=100, overflow=OverflowPolicy.drop_newest)
+    assert buffer.put("a", 10)
+    assert not buffer.put("b", 10)
+    assert buffer.dropped == 1
+    assert buffer.get() == ["a"]
+
+
+def test_coalesce():
+    buffer = IngestBuffer(max_batches=2, max_bytes=100, overflow=OverflowPolicy.coalesce)
+    assert buffer.put("a", 10)
+    assert buffer.put("b", 10)
+    assert buffer.put("c", 10)
+    assert buffer.put("d", 10)
+    assert len(buffer) == 2
+    assert buffer.put("e", 70)
+    assert buffer.dropped == 1
+    assert buffer.get() == ["b", "c", "d"]
+    assert buffer.get() == ["e"]
+    assert buffer.size == 0
+
+
+def test_oversized_batch():
+    buffer = IngestBuffer(max_batches=2, max_bytes=100, overflow=OverflowPolicy.reject)
+    assert buffer.put("a", 1000)
+    assert not buffer.put("b", 1)
+    assert buffer.get() == ["a"]
+
+
+def test_close():
+    buffer = IngestBuffer(max_batches=1, max_bytes=100, overflow=OverflowPolicy.reject)
+    result = []
+    consumer = threading.Thread(target=lambda: result.append(buffer.get()))
+    consumer.start()
+    buffer.close()
+    consumer.join(timeout=5)
+    assert result == [None]
+    assert not buffer.put("a", 1)
+    assert buffer.get(timeout=0) is None
+
+
+def test_async_buffer():
+    async def consume(buffer):
+        return [await buffer.get(), await buffer.get(), await buffer.get()]
+
+    async def produce(buffer):
+        buffer.put("a", 1)
+        await asyncio.sleep(0)
+        buffer.put("b", 1)
+        buffer.put("c", 1)
+        await asyncio.sleep(0)
+        buffer.close()
+
+    async def main():
+        buffer = AsyncIngestBuffer(max_batches=1, max_bytes=100, overflow=OverflowPolicy.coalesce)
+        consumer = asyncio.ensure_future(consume(buffer))
+        await asyncio.sleep(0)
+        await produce(buffer)
+        return await consumer
+
+    assert asyncio.run(main()) == [["a"], ["b", "c"], None]
@@ -0,0 +1,56 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import pytest
+
+from sfxbridge.cardinality import HyperLogLog, SeriesLimiter
+
+
+@pytest.mark.parametrize("count", [0, 1, 50, 1000, 20000])
+def test_hyperloglog(count):
+    estimator = HyperLogLog()
+    for value in range(count):
+        estimator.add(("host", f"eth{value}"))
+        estimator.add(("host", f"eth{value}"))
+    assert abs(estimator.count() - count) <= max(count * 0.1, 1)
+
+
+def test_series_limiter():
+    limiter = SeriesLimiter(default_limit=2, limits={"network.*": 1, "load.*": None})
+    assert limiter.admit(["memory.used", "memory.free"], "a")
+    assert limiter.admit(["memory.used", "memory.free"], "b")
+    assert not limiter.admit(["memory.used", "memory.free"], "c")
+    assert limiter.admit(["memory.used", "memory.free"], "a")
+
+    assert limiter.admit(["network.total"], "a")
+    assert not limiter.admit(["network.total"], "b")
+
+    for value in range(10):
+        assert limiter.admit(["load.midterm"], value)
+
+    assert limiter.limited == 2
+    assert limiter.counts() == {
+        "load.midterm": 10,
+        "memory.free": 3,
+        "memory.used": 3,
+        "network.total": 2,
+    }
+
+
+def test_series_limiter_expiry():
+    limiter = SeriesLimiter(default_limit=2, expiry=10)
+    start = limiter._rotated_at  # pylint: disable=protected-access
+    assert limiter.admit(["memory.used"], "a")
+    assert limiter.admit(["memory.used"], "b")
+    assert not limiter.admit(["memory.used"], "c")
+    assert limiter.expire(now=start + 5) == []
+
+    # Series are kept as long as they are seen within every period
+    assert limiter.expire(now=start + 10) == []
+    limiter.seen(["memory.used"], "b")
+    assert limiter.counts() == {"memory.used": 3}
+    assert limiter.expire(now=start + 20) == ["a", "c"]
+    assert limiter.counts() == {"memory.used": 1}
+
+    # There is room for a new series once an idle one has expired
+    assert limiter.admit(["memory.used"], "c")
+    assert not limiter.admit(["memory.used"], "d")
+    assert limiter.limited == 2
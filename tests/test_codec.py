@@ -0,0 +1,44 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import json
+
+import pytest
+
+from sfxbridge import codec
+from sfxbridge.maps.metrics import DataPointType
+
+POINTS = {
+    DataPointType.gauge: [{
+        "metric": "load.midterm",
+        "value": 0.47,
+        "dimensions": {
+            "host": "pg-2",
+            "note": "käyttäjä"
+        },
+        "timestamp": 1570444470000,
+    }],
+    DataPointType.cumulative: [{
+        "metric": "counter.kafka-bytes-in",
+        "value": 717688622,
+        "dimensions": {
+            "host": "k1-3"
+        },
+    }],
+}
+
+
+@pytest.mark.parametrize("loads,dumps", [
+    (codec._json_loads, codec._json_dumps),  # pylint: disable=protected-access
+    (codec.loads, codec.dumps),
+])
+def test_round_trip(loads, dumps):
+    encoded = dumps(POINTS)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == {"gauge": POINTS[DataPointType.gauge], "cumulative_counter": POINTS[DataPointType.cumulative]}
+    assert loads(encoded) == json.loads(encoded)
+
+
+@pytest.mark.parametrize("dumps", [codec._json_dumps, codec.dumps])  # pylint: disable=protected-access
+def test_non_finite(dumps):
+    encoded = dumps({DataPointType.gauge: [{"metric": "load.midterm", "value": float("nan")}], "values": [float("-inf"), 1.5]})
+    assert json.loads(encoded) == {"gauge": [{"metric": "load.midterm", "value": None}], "values": [None, 1.5]}
+    assert b"NaN" not in encoded
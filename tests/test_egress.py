@@ -0,0 +1,50 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import json
+
+import pytest
+
+from sfxbridge import codec, egress
+from sfxbridge.mapper import FrozenDimensions
+from sfxbridge.maps.metrics import DataPointType
+
+DIMENSIONS = FrozenDimensions({"host": "pg-2", "cluster": "pg", "plugin": "load"})
+
+
+def _points(timestamp):
+    return {
+        DataPointType.gauge: [
+            {"metric": "load.midterm", "value": 0.47, "dimensions": DIMENSIONS, "timestamp": timestamp},
+            {"metric": "load.shortterm", "value": float("nan"), "dimensions": DIMENSIONS, "timestamp": timestamp},
+        ],
+        DataPointType.cumulative: [
+            {"metric": "network.total", "value": 1 << 40, "dimensions": FrozenDimensions({"host": "pg-2"})},
+        ],
+    }
+
+
+@pytest.mark.parametrize("dumps", [codec._json_dumps, codec.dumps])  # pylint: disable=protected-access
+def test_encode(dumps, monkeypatch):
+    # Non-finite values are encoded as null with either codec
+    monkeypatch.setattr(codec, "dumps", dumps)
+    encoder = egress.JsonEncoder()
+    for timestamp in (1570444470000, 1570444480000):
+        assert json.loads(encoder.encode(_points(timestamp))) == {
+            "gauge": [
+                {"metric": "load.midterm", "value": 0.47, "dimensions": dict(DIMENSIONS), "timestamp": timestamp},
+                {"metric": "load.shortterm", "value": None, "dimensions": dict(DIMENSIONS), "timestamp": timestamp},
+            ],
+            "cumulative_counter": [
+                {"metric": "network.total", "value": 1 << 40, "dimensions": {"host": "pg-2"}},
+            ],
+        }
+    # The cumulative counter dimensions are a new dict each time
+    assert encoder.misses == 4
+    assert encoder.hits == 2
+
+
+def test_eviction():
+    encoder = egress.JsonEncoder(max_series=2)
+    encoder.encode(_points(1570444470000))
+    assert len(encoder) == 2
+    assert encoder.misses == 3
+    assert encoder.hits == 0
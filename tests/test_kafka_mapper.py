@@ -242,3 +242,12 @@ def test_request_metrics():
             },
         ],
     }
+
+
+def test_collector_dispatch():
+    mapper = Mapper(log=log, whitelist=[], service="kafka")
+    dispatch = mapper._dispatch  # pylint: disable=protected-access
+    assert [type(c).__name__ for c in dispatch["kafka.network:RequestMetrics.TotalTimeMs"]] == ["RequestMetrics"]
+    assert [type(c).__name__ for c in dispatch["net"]] == ["_NetworkTotal"]
+    assert "kafka.server:ReplicaManager.IsrExpandsPerSec" not in dispatch
+    assert not mapper._catch_all  # pylint: disable=protected-access
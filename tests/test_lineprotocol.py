@@ -0,0 +1,86 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import logging
+
+import pytest
+
+from sfxbridge.lineprotocol import parse, parse_line
+
+
+def test_parse():
+    body = (
+        b"system,host=pg-2,service=pg load1=0.54,load15=0.23,n_cpus=1i 1570444470000000000\n"
+        b"\n"
+        b"# comment\n"
+        b"net,host=pg-2,interface=eth0 bytes_recv=156796692u,up=true,down=F 1570444500000000000\n"
+    )
+    assert list(parse(body)) == [
+        {
+            "name": "system",
+            "tags": {
+                "host": "pg-2",
+                "service": "pg"
+            },
+            "fields": {
+                "load1": 0.54,
+                "load15": 0.23,
+                "n_cpus": 1
+            },
+            "timestamp": 1570444470,
+        },
+        {
+            "name": "net",
+            "tags": {
+                "host": "pg-2",
+                "interface": "eth0"
+            },
+            "fields": {
+                "bytes_recv": 156796692,
+                "up": True,
+                "down": False
+            },
+            "timestamp": 1570444500,
+        },
+    ]
+
+
+def test_escapes():
+    metric = parse_line(
+        r'kafka.server:BrokerTopicMetrics.BytesInPerSec,host=k1-3,topic=a\ b\,c\=d '
+        r'Count=717688622i,note="with \"quotes\", spaces and = signs",my\ field=1 1571666310000000000'
+    )
+    assert metric == {
+        "name": "kafka.server:BrokerTopicMetrics.BytesInPerSec",
+        "tags": {
+            "host": "k1-3",
+            "topic": "a b,c=d"
+        },
+        "fields": {
+            "Count": 717688622,
+            "note": 'with "quotes", spaces and = signs',
+            "my field": 1.0,
+        },
+        "timestamp": 1571666310,
+    }
+
+
+def test_precision_and_missing_timestamp():
+    assert parse_line("mem used=1i 1570444470", precision="s")["timestamp"] == 1570444470
+    assert parse_line("mem used=1i")["timestamp"] is None
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        list(parse(b"mem\n"))
+    with pytest.raises(ValueError):
+        list(parse(b"mem used=abc 1\n"))
+    with pytest.raises(ValueError):
+        list(parse(b"mem used=1i 1 2\n"))
+    with pytest.raises(ValueError):
+        list(parse(b"mem,host used=1i 1\n"))
+
+
+def test_skip_invalid(caplog):
+    body = b"mem used=1i 1\nmem used=abc 2\nmem,host used=1i 3\nmem used=4i 4\n"
+    metrics = list(parse(body, precision="s", log=logging.getLogger()))
+    assert [metric["timestamp"] for metric in metrics] == [1, 4]
+    assert "Skipped 2 invalid" in caplog.text
@@ -1,8 +1,12 @@
 # Copyright 2019, Aiven, https://aiven.io/
 from logging import getLogger
 
+import pytest
+
+from sfxbridge import maps
+from sfxbridge.cardinality import SeriesLimiter
 from sfxbridge.mapper import Mapper
-from sfxbridge.maps.metrics import DataPointType
+from sfxbridge.maps.metrics import DataPointType, Transform
 
 log = getLogger(__name__)
 
@@ -142,3 +146,319 @@ def test_network_total():
             "timestamp": 1570444500000,
         }]
     }
+
+
+def test_mapping_plan():
+    mapper = Mapper(log=log, whitelist=["memory.used", "memory.free", "memory.utilization"], service=None)
+    assert [field.name for rule in mapper._plan["mem"] for field in rule.fields] == [  # pylint: disable=protected-access
+        "memory.used", "memory.free", "memory.utilization"
+    ]
+    assert "system" not in mapper._plan  # pylint: disable=protected-access
+
+    mapper.process([
+        {
+            "fields": {
+                "free": 100,
+                "used": 200,
+                "used_percent": 66.7,
+                "wired": 0,
+            },
+            "name": "mem",
+            "tags": {
+                "host": "pg-2",
+                "service": "pg",
+            },
+            "timestamp": 1570444470
+        },
+    ])
+    assert mapper.datapoints == {
+        DataPointType.gauge: [
+            {
+                "dimensions": {
+                    "cluster": "pg",
+                    "host": "pg-2",
+                    "plugin": "memory",
+                },
+                "metric": "memory.used",
+                "value": 200,
+                "timestamp": 1570444470000,
+            },
+            {
+                "dimensions": {
+                    "cluster": "pg",
+                    "host": "pg-2",
+                    "plugin": "memory",
+                },
+                "metric": "memory.free",
+                "value": 100,
+                "timestamp": 1570444470000,
+            },
+            {
+                "dimensions": {
+                    "cluster": "pg",
+                    "host": "pg-2",
+                    "plugin": "signalfx-metadata",
+                },
+                "metric": "memory.utilization",
+                "value": 66.7,
+                "timestamp": 1570444470000,
+            },
+        ]
+    }
+
+
+def test_supported_datapoints():
+    assert "cpu.utilization" in Mapper.supported_datapoints()
+    # Datapoints constructed from the measurements are included
+    assert set(Mapper.supported_datapoints(measurements=["cpu"])) == {"cpu.utilization"}
+    net = set(Mapper.supported_datapoints(measurements=["net"]))
+    assert {"if_octets.rx", "network.total"} <= net
+    assert "cpu.utilization" not in net
+
+
+def test_interned_dimensions():
+    def load(host, timestamp):
+        return {
+            "fields": {
+                "load1": 0.54,
+                "load5": 0.47,
+            },
+            "name": "system",
+            "tags": {
+                "host": host,
+                "service": "pg",
+            },
+            "timestamp": timestamp,
+        }
+
+    mapper = Mapper(log=log, whitelist=["load.shortterm", "load.midterm"], service=None, dimension_cache_size=2)
+    mapper.process([load("pg-1", 1570444470), load("pg-1", 1570444480), load("pg-2", 1570444480)])
+    gauges = mapper.datapoints[DataPointType.gauge]
+    assert len(gauges) == 6
+    # All the datapoints of the same host share the dimensions
+    assert all(dp["dimensions"] is gauges[0]["dimensions"] for dp in gauges[:4])
+    assert gauges[4]["dimensions"] is not gauges[0]["dimensions"]
+    assert gauges[4]["dimensions"] == {"cluster": "pg", "host": "pg-2", "plugin": "load"}
+    assert mapper.dimension_cache_hits == 1
+    assert mapper.dimension_cache_misses == 2
+
+    try:
+        gauges[0]["dimensions"]["host"] = "pg-3"
+        assert False, "shared dimensions must not be modifiable"
+    except TypeError:
+        pass
+    dimensions = gauges[0]["dimensions"]
+    try:
+        dimensions |= {"host": "pg-3"}
+        assert False, "shared dimensions must not be modifiable"
+    except TypeError:
+        pass
+    assert gauges[0]["dimensions"]["host"] == "pg-1"
+
+    # Least recently used dimensions are evicted
+    mapper.clear()
+    mapper.process([load("pg-3", 1570444490), load("pg-1", 1570444490)])
+    assert mapper.dimension_cache_size == 2
+    assert mapper.dimension_cache_misses == 4
+
+
+@pytest.mark.parametrize("policy", ["drop", "fold"])
+def test_series_limit(policy):
+    limiter = SeriesLimiter(limits={"if_octets.*": 2}, policy=policy)
+    mapper = Mapper(log=log, whitelist=["if_octets.rx"], service=None, series_limiter=limiter)
+    mapper.process([{
+        "fields": {
+            "bytes_recv": index,
+        },
+        "name": "net",
+        "tags": {
+            "host": "pg-2",
+            "interface": f"eth{index}",
+            "service": "pg",
+        },
+        "timestamp": 1570444470,
+    } for index in (0, 1, 2, 3, 0)])
+
+    dps = mapper.datapoints[DataPointType.cumulative]
+    instances = [(dp["dimensions"]["plugin_instance"], dp["value"]) for dp in dps]
+    if policy == "drop":
+        assert instances == [("eth0", 0), ("eth1", 1), ("eth0", 0)]
+    else:
+        # Cumulative counters of the folded series are summed
+        assert instances == [("eth0", 0), ("eth1", 1), ("_other", 5), ("eth0", 0)]
+        assert dps[2]["dimensions"] == {"host": "pg-2", "cluster": "pg", "plugin": "net-io", "plugin_instance": "_other"}
+    assert limiter.limited == 2
+    assert limiter.counts() == {"if_octets.rx": 4}
+
+
+def test_series_limit_fold(monkeypatch):
+    mappings = {
+        "disk": {
+            "used": {
+                "name": "df_complex.used",
+                "type": DataPointType.gauge,
+                "dimensions": [("host", "$host"), ("plugin_instance", "$path")],
+            },
+        },
+        "system": {
+            "load5": {
+                "name": "load.midterm",
+                "type": DataPointType.gauge,
+                "dimensions": [("host", "$host")],
+            },
+        },
+    }
+    monkeypatch.setattr(maps, "get_rules", lambda service: (mappings, []))
+    limiter = SeriesLimiter(default_limit=1, policy="fold")
+    mapper = Mapper(log=log, whitelist={"df_complex.used", "load.midterm"}, service=None, series_limiter=limiter)
+
+    def process():
+        mapper.clear()
+        mapper.process([{
+            "fields": {"used": index + 1},
+            "name": "disk",
+            "tags": {"host": host, "path": f"/mnt/{index}"},
+            "timestamp": 1570444470,
+        } for host in ("a", "b") for index in range(3)] + [{
+            "fields": {"load5": index},
+            "name": "system",
+            "tags": {"host": host},
+            "timestamp": 1570444470,
+        } for index, host in enumerate(("a", "b", "c"))])
+        return [(dp["metric"], dict(dp["dimensions"]), dp["value"]) for dp in mapper.datapoints[DataPointType.gauge]]
+
+    # The values of the folded series are summed per host, or altogether if host is the only tag dimension
+    expected = [
+        ("df_complex.used", {"host": "a", "plugin_instance": "/mnt/0"}, 1),
+        ("df_complex.used", {"host": "a", "plugin_instance": "_other"}, 5),
+        ("df_complex.used", {"host": "b", "plugin_instance": "_other"}, 6),
+        ("load.midterm", {"host": "a"}, 0),
+        ("load.midterm", {"host": "_other"}, 3),
+    ]
+    assert process() == expected
+    first = [dp["dimensions"] for dp in mapper.datapoints[DataPointType.gauge]]
+    assert process() == expected
+    # The folded dimensions are interned like the others
+    assert all(a is b for a, b in zip(first, (dp["dimensions"] for dp in mapper.datapoints[DataPointType.gauge])))
+
+
+def test_series_limit_all_fields():
+    limiter = SeriesLimiter(limits={"if_octets.tx": 1})
+    mapper = Mapper(log=log, whitelist=["if_octets.rx", "if_octets.tx"], service=None, series_limiter=limiter)
+
+    def net(interface, fields):
+        return {"fields": fields, "name": "net", "tags": {"host": "pg-2", "interface": interface}, "timestamp": 1570444470}
+
+    # The series of eth0 counts towards the limit of if_octets.tx before the field shows up
+    mapper.process([net("eth0", {"bytes_recv": 1}), net("eth1", {"bytes_recv": 2, "bytes_sent": 3})])
+    mapper.process([net("eth0", {"bytes_recv": 4, "bytes_sent": 5})])
+    dps = mapper.datapoints[DataPointType.cumulative]
+    assert [(dp["metric"], dp["dimensions"]["plugin_instance"], dp["value"]) for dp in dps] == [
+        ("if_octets.rx", "eth0", 1),
+        ("if_octets.rx", "eth0", 4),
+        ("if_octets.tx", "eth0", 5),
+    ]
+    assert limiter.limited == 1
+    assert limiter.counts() == {"if_octets.rx": 2, "if_octets.tx": 2}
+
+
+def test_series_limit_expiry():
+    limiter = SeriesLimiter(default_limit=1, expiry=600)
+    mapper = Mapper(log=log, whitelist=["if_octets.rx"], service=None, series_limiter=limiter)
+
+    def net(interface, value):
+        tags = {"host": "pg-2", "interface": interface, "service": "pg"}
+        return {"fields": {"bytes_recv": value}, "name": "net", "tags": tags, "timestamp": 1570444470}
+
+    def interfaces():
+        return [dp["dimensions"]["plugin_instance"] for dp in mapper.datapoints.get(DataPointType.cumulative, [])]
+
+    mapper.process([net("eth0", 1), net("eth1", 2)])
+    assert interfaces() == ["eth0"]
+
+    # eth0 is gone, after a period without it eth1 takes its place
+    for _ in range(2):
+        limiter._rotated_at -= 600  # pylint: disable=protected-access
+        mapper.clear()
+        mapper.process([net("eth1", 3)])
+        assert interfaces() == []
+    mapper.clear()
+    mapper.process([net("eth1", 4), net("eth0", 5)])
+    assert interfaces() == ["eth1"]
+    assert limiter.counts() == {"if_octets.rx": 2}
+
+
+def test_transform(monkeypatch):
+    dimensions = [("host", "$host"), ("plugin_instance", "$interface")]
+    mappings = {
+        "net": {
+            "bytes_recv": {
+                "name": "if_octets.rx.rate",
+                "type": DataPointType.gauge,
+                "dimensions": dimensions,
+                "transform": Transform.rate,
+            },
+            "packets_recv": {
+                "name": "if_packets.rx.delta",
+                "type": DataPointType.counter,
+                "dimensions": dimensions,
+                "transform": Transform.delta,
+            },
+        },
+    }
+    monkeypatch.setattr(maps, "get_rules", lambda service: (mappings, []))
+    mapper = Mapper(log=log, whitelist={"if_octets.rx.rate", "if_packets.rx.delta"}, service=None)
+
+    def process(timestamp, bytes_recv, packets_recv):
+        mapper.clear()
+        mapper.process([{
+            "fields": {
+                "bytes_recv": bytes_recv,
+                "packets_recv": packets_recv,
+            },
+            "name": "net",
+            "tags": {
+                "host": "pg-2",
+                "interface": "eth0",
+            },
+            "timestamp": timestamp,
+        }])
+        return {dp_type: [dp["value"] for dp in dps] for dp_type, dps in mapper.datapoints.items()}
+
+    # Nothing to derive from the first values
+    assert process(1570444470, 1000, 10) == {}
+    assert process(1570444480, 6000, 15) == {DataPointType.gauge: [500.0], DataPointType.counter: [5]}
+    # Counter reset
+    assert process(1570444490, 100, 1) == {}
+    assert process(1570444500, 300, 3) == {DataPointType.gauge: [20.0], DataPointType.counter: [2]}
+
+
+def test_transform_fold(monkeypatch):
+    mappings = {
+        "net": {
+            "bytes_recv": {
+                "name": "if_octets.rx.rate",
+                "type": DataPointType.gauge,
+                "dimensions": [("host", "$host"), ("plugin_instance", "$interface")],
+                "transform": Transform.rate,
+            },
+        },
+    }
+    monkeypatch.setattr(maps, "get_rules", lambda service: (mappings, []))
+    limiter = SeriesLimiter(default_limit=1, policy="fold")
+    mapper = Mapper(log=log, whitelist={"if_octets.rx.rate"}, service=None, series_limiter=limiter)
+
+    def process(timestamp, values):
+        mapper.clear()
+        mapper.process([{
+            "fields": {"bytes_recv": value},
+            "name": "net",
+            "tags": {"host": "pg-2", "interface": interface},
+            "timestamp": timestamp,
+        } for interface, value in values])
+        return [(dp["dimensions"]["plugin_instance"], dp["value"]) for dp in mapper.datapoints.get(DataPointType.gauge, [])]
+
+    assert process(1570444470, [("eth0", 0), ("eth1", 0), ("eth2", 0)]) == []
+    # The rates are derived per folded series and then summed, in whichever order they come
+    assert process(1570444480, [("eth0", 10), ("eth1", 10000), ("eth2", 10)]) == [("eth0", 1.0), ("_other", 1001.0)]
+    assert process(1570444490, [("eth2", 20), ("eth0", 20), ("eth1", 20000)]) == [("_other", 1001.0), ("eth0", 1.0)]
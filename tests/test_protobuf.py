@@ -0,0 +1,125 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import struct
+
+from sfxbridge import protobuf
+from sfxbridge.maps.metrics import DataPointType
+
+
+def _varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _fields(data):
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        wire_type = key & 0x07
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield key >> 3, value
+
+
+def decode(data):
+    """Minimal DataPointUploadMessage decoder for verifying the encoder output"""
+    metric_types = {v: k for k, v in protobuf.METRIC_TYPES.items()}
+    points = {}
+    for _, raw in _fields(data):
+        dp = {"dimensions": {}}
+        dp_type = DataPointType.gauge
+        for number, value in _fields(raw):
+            if number == 2:
+                dp["metric"] = value.decode("utf-8")
+            elif number == 3:
+                dp["timestamp"] = value
+            elif number == 4:
+                for datum_number, datum in _fields(value):
+                    if datum_number == 1:
+                        dp["value"] = datum.decode("utf-8")
+                    elif datum_number == 2:
+                        dp["value"] = struct.unpack("<d", datum)[0]
+                    else:
+                        dp["value"] = datum - (1 << 64) if datum >= 1 << 63 else datum
+            elif number == 5:
+                dp_type = metric_types[value]
+            elif number == 6:
+                dimension = dict(_fields(value))
+                dp["dimensions"][dimension[1].decode("utf-8")] = dimension[2].decode("utf-8")
+        points.setdefault(dp_type, []).append(dp)
+    return points
+
+
+POINTS = {
+    DataPointType.gauge: [
+        {
+            "metric": "load.midterm",
+            "value": 0.47,
+            "dimensions": {
+                "host": "pg-2",
+                "cluster": "pg",
+                "plugin": "load",
+            },
+            "timestamp": 1570444470000,
+        },
+        {
+            "metric": "gauge.kafka-offline-partitions-count",
+            "value": -1,
+            "dimensions": {
+                "host": "k1-3",
+            },
+        },
+    ],
+    DataPointType.cumulative: [
+        {
+            "metric": "counter.kafka-bytes-in",
+            "value": 717688622,
+            "dimensions": {
+                "host": "k1-3",
+                "cluster": "k1",
+                "hostHasService": "kafka",
+            },
+            "timestamp": 1571666310000,
+        },
+    ],
+    DataPointType.counter: [
+        {
+            "metric": "network.total",
+            "value": 180826311,
+            "dimensions": {
+                "host": "pg-2",
+                "cluster": "pg",
+            },
+            "timestamp": 1570444500000,
+        },
+    ],
+}
+
+
+def test_round_trip():
+    assert decode(protobuf.encode(POINTS)) == POINTS
+
+
+def test_string_keys():
+    points = {"cumulative_counter": POINTS[DataPointType.cumulative]}
+    assert decode(protobuf.encode(points)) == {DataPointType.cumulative: POINTS[DataPointType.cumulative]}
+
+
+def test_skip_missing_value():
+    points = {DataPointType.gauge: [{"metric": "load.midterm", "value": None, "dimensions": {}}]}
+    assert protobuf.encode(points) == b""
@@ -0,0 +1,21 @@
+# Copyright 2019, Aiven, https://aiven.io/
+from sfxbridge.series import SeriesStore
+
+
+def test_series_store():
+    store = SeriesStore(expiry=60)
+    assert store.update("a", 1, 1570444470, now=0) is None
+    assert store.update("b", 5, 1570444470, now=0) is None
+    assert store.update("a", 3, 1570444480, now=10) == (1, 1570444470)
+    assert len(store) == 2
+
+    # Too early for expiring anything
+    assert store.expire(now=30) == 0
+    assert store.update("a", 4, 1570444540, now=70) == (3, 1570444480)
+    assert store.expire(now=70) == 1
+    assert len(store) == 1
+
+    # The slot of the expired series is reused
+    assert store.update("c", 7, 1570444540, now=70) is None
+    assert len(store._values) == 2  # pylint: disable=protected-access
+    assert store.update("b", 6, 1570444550, now=80) is None
@@ -1,5 +1,64 @@
 # Copyright 2019, Aiven, https://aiven.io/
-from sfxbridge.sfxbridge import SfxClient
+import asyncio
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from sfxbridge import sfxbridge, stats
+from sfxbridge.buffer import AsyncIngestBuffer, IngestBuffer, OverflowPolicy
+from sfxbridge.maps.metrics import DataPointType
+from sfxbridge.sfxbridge import AsyncSfxClient, DataFormat, SfxClient
+
+from .test_protobuf import decode, POINTS
+
+
+class _Status:
+    def __init__(self):
+        self.status = {}
+        self.batches = []
+
+    def update_status(self, key, value):
+        self.status[key] = value
+
+    def record_batch(self, **batch):
+        self.batches.append(batch)
+
+
+class _IngestServer(ThreadingHTTPServer):
+    """Local stand-in for the SignalFX ingest API recording the received requests"""
+    daemon_threads = True
+
+    def __init__(self, responses=None):
+        self.received = []
+        # list of (status, headers) to reply with before replying 200
+        self.responses = list(responses or [])
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                self.server.received.append((dict(self.headers), body))
+                status, headers = self.server.responses.pop(0) if self.server.responses else (200, {})
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v2/datapoint"
 
 
 def test_default_whitelist():
@@ -15,3 +74,519 @@ def test_configured_whitelist():
 def test_service_whitelist():
     sfxclient = SfxClient(server=None, queue=None, config={"realm": "foo", "service": "kafka"})
     assert "gauge.kafka-underreplicated-partitions" in sfxclient.whitelist
+
+
+@pytest.mark.parametrize("fragment_cache_size", [0, 16])
+def test_gzip_encode(fragment_cache_size):
+    sfxclient = SfxClient(
+        server=_Status(),
+        queue=None,
+        config={
+            "realm": "foo",
+            "compression": "gzip",
+            "compression_min_size": 128,
+            "fragment_cache_size": fragment_cache_size,
+        }
+    )
+    points = {
+        "gauge": [
+            {
+                "metric": "load.shortterm",
+                "value": 1,
+                "dimensions": {
+                    "host": "b"
+                }
+            },
+            {
+                "metric": "load.midterm",
+                "value": 2,
+                "dimensions": {
+                    "host": "a"
+                }
+            },
+            {
+                "metric": "load.shortterm",
+                "value": 3,
+                "dimensions": {
+                    "host": "a"
+                }
+            },
+        ]
+    }
+    body, headers = sfxclient._encode(points)  # pylint: disable=protected-access
+    assert headers == {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    assert "encode-time" in sfxclient.server.status
+    decoded = json.loads(gzip.decompress(body))
+    assert [(dp["metric"], dp["dimensions"]["host"]) for dp in decoded["gauge"]] == [
+        ("load.midterm", "a"),
+        ("load.shortterm", "a"),
+        ("load.shortterm", "b"),
+    ]
+
+    body, headers = sfxclient._encode({"gauge": points["gauge"][:1]})  # pylint: disable=protected-access
+    assert headers == {"Content-Type": "application/json"}
+    assert json.loads(body) == {"gauge": points["gauge"][:1]}
+
+
+def test_protobuf_send():
+    server = _IngestServer()
+    try:
+        sfxclient = SfxClient(server=_Status(), queue=None, config={"realm": "foo", "format": "protobuf"})
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sfxclient.send({DataPointType(k): list(v) for k, v in POINTS.items()})
+    finally:
+        server.shutdown()
+
+    headers, body = server.received[0]
+    assert headers["Content-Type"] == "application/x-protobuf"
+    assert decode(body) == POINTS
+
+
+def _send_with_responses(responses, config=None):
+    server = _IngestServer(responses)
+    status = _Status()
+    try:
+        sfxclient = SfxClient(server=status, queue=None, config={"realm": "foo", "retry_backoff": 0.01, **(config or {})})
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sfxclient.send({DataPointType.gauge: [{"metric": "load.midterm", "value": 1, "dimensions": {}}]})
+    finally:
+        server.shutdown()
+    return server, status.status
+
+
+def test_retry():
+    sent = sfxbridge.REQUESTS.value(("sent", ))
+    errors = sfxbridge.POST_ERRORS.value(("503", ))
+    server, status = _send_with_responses([(503, {}), (429, {"Retry-After": "0"})])
+    assert len(server.received) == 3
+    assert status["retries"] == 2
+    assert status["state"] == "connected"
+    assert sfxbridge.REQUESTS.value(("sent", )) == sent + 1
+    assert sfxbridge.POST_ERRORS.value(("503", )) == errors + 1
+    assert "sfxbridge_post_seconds_count" in stats.REGISTRY.render()
+    assert "give-ups" not in status
+
+
+def test_no_retry_on_fatal_error():
+    server, status = _send_with_responses([(400, {}), (400, {})])
+    assert len(server.received) == 1
+    assert status["http-status"] == 400
+    assert status["state"] == "rejected"
+    assert "retries" not in status
+
+
+def test_retry_deadline():
+    server, status = _send_with_responses([(500, {"Retry-After": "1"})] * 2, config={"retry_deadline": 0.5})
+    assert len(server.received) == 1
+    assert status["give-ups"] == 1
+    assert status["state"] == "disconnected"
+
+
+def test_retry_deadline_per_batch():
+    server = _IngestServer([(503, {})] * 100)
+    status = _Status()
+    try:
+        sfxclient = SfxClient(
+            server=status,
+            queue=None,
+            config={"realm": "foo", "retry_backoff": 0.05, "retry_deadline": 0.5, "max_request_datapoints": 1},
+        )
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        start = time.monotonic()
+        result = sfxclient.send(_load_points(5))
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+
+    # The requests of the batch share the deadline, the rest are given up with the first one
+    assert result == sfxbridge.PostResult.failed
+    assert elapsed < 1.0
+    assert status.status["give-ups"] == 1
+    assert {json.loads(body)["gauge"][0]["value"] for _, body in server.received} == {0}
+
+
+def test_spool(tmp_path):
+    server = _IngestServer([(503, {})])
+    status = _Status()
+    try:
+        sfxclient = SfxClient(
+            server=status,
+            queue=None,
+            config={
+                "realm": "foo",
+                "retry_deadline": 0,
+                "spool_dir": str(tmp_path / "spool"),
+                "spool_drain_rate": 10,
+            },
+        )
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sfxclient.send({DataPointType.gauge: [{"metric": "load.midterm", "value": 1, "dimensions": {}}]})
+        assert status.status["spooled-bytes"] > 0
+
+        sfxclient._drain_time -= 1  # pylint: disable=protected-access
+        sfxclient.send({DataPointType.gauge: [{"metric": "load.midterm", "value": 2, "dimensions": {}}]})
+    finally:
+        server.shutdown()
+
+    assert status.status["spooled-bytes"] == 0
+    assert [json.loads(body)["gauge"][0]["value"] for _, body in server.received] == [1, 2, 1]
+
+
+def test_connection_reuse():
+    server = _IngestServer()
+    status = _Status()
+    try:
+        sfxclient = SfxClient(server=status, queue=None, config={"realm": "foo", "pool_idle_timeout": 0.2})
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        for value in range(3):
+            sfxclient.send({DataPointType.gauge: [{"metric": "load.midterm", "value": value, "dimensions": {}}]})
+        assert status.status["connections"] == 1
+        assert status.status["connection-reuses"] == 2
+
+        # The idle keep-alive connection is discarded and a new one opened
+        time.sleep(0.3)
+        sfxclient.send({DataPointType.gauge: [{"metric": "load.midterm", "value": 3, "dimensions": {}}]})
+        assert status.status["connections"] == 2
+        assert status.status["connection-reuses"] == 2
+    finally:
+        server.shutdown()
+    assert len(server.received) == 4
+
+
+def test_concurrent_send():
+    server = _IngestServer()
+    try:
+        sfxclient = SfxClient(server=_Status(), queue=None, config={"realm": "foo", "max_in_flight": 3})
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        for value in range(5):
+            sfxclient.send({
+                DataPointType.gauge: [{
+                    "metric": "load.midterm",
+                    "value": value,
+                    "dimensions": {
+                        "host": f"host-{host}"
+                    }
+                } for host in range(10)]
+            })
+        for lane in sfxclient._lanes:  # pylint: disable=protected-access
+            lane.shutdown(wait=True)
+    finally:
+        server.shutdown()
+
+    series = {}
+    for _, body in server.received:
+        for dp in json.loads(body)["gauge"]:
+            series.setdefault(dp["dimensions"]["host"], []).append(dp["value"])
+    assert len(series) == 10
+    assert all(values == list(range(5)) for values in series.values())
+
+
+def test_async_sender():
+    server = _IngestServer([(503, {})])
+    status = _Status()
+
+    async def run_sender(config):
+        buffer = AsyncIngestBuffer(max_batches=10, max_bytes=1024 * 1024, overflow=OverflowPolicy.reject)
+        sfxclient = AsyncSfxClient(server=status, queue=buffer, config=config)
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sender = asyncio.ensure_future(sfxclient.run())
+        for value in range(3):
+            buffer.put((DataFormat.json, json.dumps({
+                "metrics": [{
+                    "fields": {
+                        "load5": value
+                    },
+                    "name": "system",
+                    "tags": {
+                        "host": "pg-2",
+                        "service": "pg"
+                    },
+                    "timestamp": 1570444470 + value
+                }]
+            })), 100)
+        for _ in range(500):
+            # Wait for the last response to be handled too, not just received by the server
+            if len(server.received) >= 4 and status.status.get("state") == "connected":
+                break
+            await asyncio.sleep(0.01)
+        sfxclient.stop()
+        await sender
+
+    try:
+        asyncio.run(run_sender({"realm": "foo", "retry_backoff": 0.01, "whitelist": ["load.midterm"], "max_in_flight": 2}))
+    finally:
+        server.shutdown()
+
+    assert [json.loads(body)["gauge"][0]["value"] for _, body in server.received] == [0, 0, 1, 2]
+    # Sent by the lanes, so the results are not known when recorded
+    assert [(batch["metrics"], batch["datapoints"], batch["result"]) for batch in status.batches] == [(1, 1, None)] * 3
+    assert status.status["retries"] == 1
+    assert status.status["connection-reuses"] >= 1
+    assert status.status["state"] == "stopping"
+
+
+def test_async_spool(tmp_path):
+    server = _IngestServer([(503, {})])
+    status = _Status()
+
+    async def run_sender(config):
+        buffer = AsyncIngestBuffer(max_batches=10, max_bytes=1024 * 1024, overflow=OverflowPolicy.reject)
+        sfxclient = AsyncSfxClient(server=status, queue=buffer, config=config)
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sender = asyncio.ensure_future(sfxclient.run())
+        for value in range(2):
+            metrics = {"metrics": [{"fields": {"load5": value}, "name": "system", "tags": {}, "timestamp": 1570444470}]}
+            buffer.put((DataFormat.json, json.dumps(metrics).encode("utf-8")), 100)
+            await asyncio.sleep(0.2)
+        for _ in range(500):
+            if len(server.received) >= 3 and status.status.get("spooled-bytes") == 0:
+                break
+            await asyncio.sleep(0.01)
+        sfxclient.stop()
+        await sender
+
+    try:
+        asyncio.run(
+            run_sender({
+                "realm": "foo",
+                "retry_deadline": 0,
+                "whitelist": ["load.midterm"],
+                "spool_dir": str(tmp_path / "spool"),
+                "spool_drain_rate": 10,
+            })
+        )
+    finally:
+        server.shutdown()
+
+    assert [json.loads(body)["gauge"][0]["value"] for _, body in server.received] == [0, 1, 0]
+    assert status.status["spooled-bytes"] == 0
+
+
+def test_aggregation_window():
+    server = _IngestServer()
+    status = _Status()
+    buffer = IngestBuffer(max_batches=10, max_bytes=1024 * 1024, overflow=OverflowPolicy.reject)
+    sfxclient = SfxClient(
+        server=status,
+        queue=buffer,
+        config={
+            "realm": "foo",
+            "aggregation_window": 0.5,
+            "whitelist": ["load.midterm"]
+        },
+    )
+    sfxclient._url = server.url  # pylint: disable=protected-access
+    sender = threading.Thread(target=sfxclient.run)
+    sender.start()
+    try:
+        for value in range(3):
+            buffer.put((DataFormat.json, json.dumps({
+                "metrics": [{
+                    "fields": {
+                        "load5": value
+                    },
+                    "name": "system",
+                    "tags": {
+                        "host": "pg-2",
+                        "service": "pg"
+                    },
+                    "timestamp": 1570444470 + value
+                }]
+            })), 100)
+        # The window ends without further metrics
+        for _ in range(200):
+            if server.received:
+                break
+            time.sleep(0.01)
+    finally:
+        sfxclient.stop()
+        sender.join()
+        server.shutdown()
+
+    assert [json.loads(body)["gauge"] for _, body in server.received] == [[{
+        "metric": "load.midterm",
+        "value": 2,
+        "dimensions": {
+            "cluster": "pg",
+            "host": "pg-2",
+            "plugin": "load"
+        },
+        "timestamp": 1570444472000,
+    }]]
+    assert status.status["aggregated-datapoints"] == 2
+
+
+def test_aggregation_window_suppress():
+    server = _IngestServer()
+    status = _Status()
+    buffer = IngestBuffer(max_batches=10, max_bytes=1024 * 1024, overflow=OverflowPolicy.reject)
+    sfxclient = SfxClient(
+        server=status,
+        queue=buffer,
+        config={
+            "realm": "foo",
+            "aggregation_window": 0.5,
+            "suppress_unchanged_gauges": True,
+            "whitelist": ["cpu.utilization"]
+        },
+    )
+    sfxclient._url = server.url  # pylint: disable=protected-access
+    sender = threading.Thread(target=sfxclient.run)
+    sender.start()
+    try:
+        # The unchanged utilizations are averaged too
+        for index, utilization in enumerate([5, 5, 5, 10]):
+            buffer.put((DataFormat.json, json.dumps({
+                "metrics": [{
+                    "fields": {
+                        "usage_idle": 100 - utilization
+                    },
+                    "name": "cpu",
+                    "tags": {
+                        "cpu": "cpu-total",
+                        "host": "pg-2",
+                        "service": "pg"
+                    },
+                    "timestamp": 1570444470 + index
+                }]
+            })), 100)
+        for _ in range(200):
+            if server.received:
+                break
+            time.sleep(0.01)
+    finally:
+        sfxclient.stop()
+        sender.join()
+        server.shutdown()
+
+    assert [[dp["value"] for dp in json.loads(body)["gauge"]] for _, body in server.received] == [[6.25]]
+    assert status.status["aggregated-datapoints"] == 3
+    assert status.status["suppressed-datapoints"] == 0
+
+
+def test_async_stop_while_mapping(monkeypatch):
+    server = _IngestServer()
+    mapping = threading.Event()
+    original_decode = AsyncSfxClient._decode  # pylint: disable=protected-access
+
+    def slow_decode(self, batch):
+        mapping.set()
+        time.sleep(0.2)
+        return original_decode(self, batch)
+
+    monkeypatch.setattr(AsyncSfxClient, "_decode", slow_decode)
+
+    async def run_sender():
+        buffer = AsyncIngestBuffer(max_batches=10, max_bytes=1024 * 1024, overflow=OverflowPolicy.reject)
+        config = {"realm": "foo", "aggregation_window": 60, "whitelist": ["load.midterm"]}
+        sfxclient = AsyncSfxClient(server=_Status(), queue=buffer, config=config)
+        sfxclient._url = server.url  # pylint: disable=protected-access
+        sender = asyncio.ensure_future(sfxclient.run())
+        metrics = {"metrics": [{"fields": {"load5": 1}, "name": "system", "tags": {}, "timestamp": 1570444470}]}
+        buffer.put((DataFormat.json, json.dumps(metrics).encode("utf-8")), 100)
+        while not mapping.is_set():
+            await asyncio.sleep(0.01)
+        sfxclient.stop()
+        await sender
+
+    try:
+        asyncio.run(run_sender())
+    finally:
+        server.shutdown()
+
+    # The batch being mapped when stopped is flushed with the aggregated datapoints
+    assert [dp["value"] for _, body in server.received for dp in json.loads(body)["gauge"]] == [1]
+
+
+INFLUX_METRIC = {"name": "system", "tags": {}, "fields": {"load5": 3}, "timestamp": 1570444470}
+
+
+def test_decode():
+    status = _Status()
+    sfxclient = SfxClient(server=status, queue=None, config={"realm": "foo"})
+    first = {"metrics": [{"name": "system", "fields": {"load5": 1}}]}
+    second = {"metrics": [{"name": "system", "fields": {"load5": 2}}]}
+    assert sfxclient._decode([(DataFormat.json, json.dumps(first).encode("utf-8"))]) == first  # pylint: disable=protected-access
+    assert sfxclient._decode([  # pylint: disable=protected-access
+        (DataFormat.json, json.dumps(first).encode("utf-8")),
+        (DataFormat.json, b"{not json"),
+        (DataFormat.influx, b"system load5=bad 1570444460000000000\nsystem load5=3i 1570444470000000000"),
+        (DataFormat.json, json.dumps(second).encode("utf-8")),
+    ]) == {"metrics": first["metrics"] + [INFLUX_METRIC] + second["metrics"]}
+    assert "decode-time" in status.status
+
+
+def test_streaming_decode():
+    sfxclient = SfxClient(server=None, queue=None, config={"realm": "foo", "streaming": True})
+    first = {"metrics": [{"name": "system", "fields": {"load5": 1}}]}
+    second = {"metrics": [{"name": "system", "fields": {"load5": 2}}]}
+    data = sfxclient._decode([  # pylint: disable=protected-access
+        (DataFormat.json, json.dumps(first).encode("utf-8")),
+        (DataFormat.json, b"{not json"),
+        (DataFormat.influx, b"system load5=3i 1570444470000000000"),
+        (DataFormat.json, json.dumps(second).encode("utf-8")),
+    ])
+    assert list(data["metrics"]) == first["metrics"] + [INFLUX_METRIC] + second["metrics"]
+
+
+def test_trace(tmp_path):
+    path = tmp_path / "trace.json"
+    status = _Status()
+    config = {"realm": "foo", "streaming": True, "trace": True, "trace_file": str(path), "trace_measurements": ["system"]}
+    sfxclient = SfxClient(server=status, queue=None, config=config)
+    metrics = [
+        {"name": "system", "tags": {"host": "a"}, "fields": {"load5": 1}, "timestamp": 1570444470},
+        {"name": "mem", "tags": {"host": "a"}, "fields": {"free": 2}, "timestamp": 1570444470},
+    ]
+    points = sfxclient._map({"metrics": iter(metrics)})  # pylint: disable=protected-access
+    assert {dp["metric"] for dp in points[DataPointType.gauge]} == {"load.midterm", "memory.free"}
+    sfxclient._tracer.close()  # pylint: disable=protected-access
+
+    with open(path) as fp:
+        traced = json.loads(fp.read())
+    assert traced["metrics"] == metrics[:1]
+    assert [dp["metric"] for dp in traced["datapoints"]["gauge"]] == ["load.midterm"]
+    assert "traced-batches" in status.status
+
+
+def test_record_batch_without_metrics():
+    status = _Status()
+    sfxclient = SfxClient(server=status, queue=None, config={"realm": "foo"})
+    sfxclient._url = None  # pylint: disable=protected-access
+    sfxclient.process({"metrics": [{"name": "system", "tags": {"host": "a"}, "fields": {"load5": 1}, "timestamp": 1570444470}]})
+    sfxclient.process({})
+    assert [(batch["metrics"], batch["datapoints"]) for batch in status.batches] == [(1, 1), (0, 0)]
+
+
+def _load_points(count):
+    return {
+        DataPointType.gauge: [{
+            "metric": "load.midterm",
+            "value": value,
+            "dimensions": {
+                "host": f"host-{value}"
+            }
+        } for value in range(count)]
+    }
+
+
+def test_single_request():
+    sfxclient = SfxClient(server=_Status(), queue=None, config={"realm": "foo"})
+    chunks = sfxclient._encode_chunks(_load_points(100))  # pylint: disable=protected-access
+    assert len(chunks) == 1
+    assert "chunked-batches" not in sfxclient.server.status
+
+
+def test_chunk_by_datapoints():
+    sfxclient = SfxClient(server=_Status(), queue=None, config={"realm": "foo", "max_request_datapoints": 30})
+    chunks = sfxclient._encode_chunks(_load_points(100))  # pylint: disable=protected-access
+    assert [len(json.loads(body)["gauge"]) for body, _ in chunks] == [25, 25, 25, 25]
+    assert [dp["value"] for body, _ in chunks for dp in json.loads(body)["gauge"]] == list(range(100))
+    assert sfxclient.server.status["chunked-batches"] == 1
+
+
+def test_chunk_by_bytes():
+    sfxclient = SfxClient(server=_Status(), queue=None, config={"realm": "foo", "max_request_bytes": 1000})
+    chunks = sfxclient._encode_chunks(_load_points(100))  # pylint: disable=protected-access
+    assert all(len(body) <= 1000 for body, _ in chunks)
+    assert [dp["value"] for body, _ in chunks for dp in json.loads(body)["gauge"]] == list(range(100))
@@ -0,0 +1,62 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import os
+
+from sfxbridge.spool import Spool
+
+
+def test_append_and_drain(tmp_path):
+    spool = Spool(path=str(tmp_path), max_bytes=1024 * 1024, segment_bytes=100)
+    for i in range(10):
+        spool.append(b"x" * 50 + bytes([i]), {"Content-Type": "application/json"})
+    assert len(spool) == 5
+    assert spool.size > 500
+
+    received = []
+    while True:
+        record = spool.peek()
+        if record is None:
+            break
+        body, headers = record
+        assert headers == {"Content-Type": "application/json"}
+        received.append(body[-1])
+        spool.advance()
+    assert received == list(range(10))
+    assert spool.size == 0
+    assert not os.listdir(tmp_path)
+
+
+def test_peek_does_not_remove(tmp_path):
+    spool = Spool(path=str(tmp_path), max_bytes=1024, segment_bytes=1024)
+    spool.append(b"first", {})
+    spool.append(b"second", {})
+    assert spool.peek() == (b"first", {})
+    assert spool.peek() == (b"first", {})
+    spool.advance()
+    assert spool.peek() == (b"second", {})
+
+
+def test_max_bytes(tmp_path):
+    spool = Spool(path=str(tmp_path), max_bytes=300, segment_bytes=100)
+    for i in range(10):
+        spool.append(b"x" * 50 + bytes([i]), {})
+    assert spool.size <= 300
+    assert spool.dropped_bytes > 0
+    assert spool.peek()[0][-1] == 6
+
+
+def test_recover(tmp_path):
+    spool = Spool(path=str(tmp_path), max_bytes=1024, segment_bytes=1024)
+    spool.append(b"first", {"Content-Encoding": "gzip"})
+    spool.append(b"second", {})
+    spool.close()
+    # Partially written record at the end of the segment is skipped
+    with open(os.path.join(tmp_path, os.listdir(tmp_path)[0]), "ab") as fp:
+        fp.write(b"\x00\x00")
+
+    spool = Spool(path=str(tmp_path), max_bytes=1024, segment_bytes=1024)
+    spool.append(b"third", {})
+    records = []
+    while spool.peek() is not None:
+        records.append(spool.peek())
+        spool.advance()
+    assert records == [(b"first", {"Content-Encoding": "gzip"}), (b"second", {}), (b"third", {})]
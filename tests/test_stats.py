@@ -0,0 +1,35 @@
+# Copyright 2019, Aiven, https://aiven.io/
+from sfxbridge import stats
+
+
+def test_render():
+    registry = stats.Registry()
+    counter = stats.Counter("test_requests_total", "Requests by result", labels=("result", ), registry=registry)
+    plain = stats.Counter("test_bytes_total", "Bytes received", registry=registry)
+    histogram = stats.Histogram("test_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+
+    counter.inc(1, ("sent", ))
+    counter.inc(2, ("sent", ))
+    counter.inc(1, ('fail"ed', ))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    assert counter.value(("sent", )) == 3
+    assert plain.value() == 0
+    assert histogram.count == 4
+    assert registry.render() == "\n".join([
+        "# HELP test_requests_total Requests by result",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{result="fail\\"ed"} 1',
+        'test_requests_total{result="sent"} 3',
+        "# HELP test_bytes_total Bytes received",
+        "# TYPE test_bytes_total counter",
+        "test_bytes_total 0",
+        "# HELP test_seconds Latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 3.65",
+        "test_seconds_count 4",
+    ]) + "\n"
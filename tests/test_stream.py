@@ -0,0 +1,69 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import json
+
+import pytest
+
+from sfxbridge.stream import iter_metrics
+
+METRICS = [
+    {
+        "fields": {
+            "load1": 0.54,
+            "load15": 0.23,
+            "n_cpus": 1234567,
+        },
+        "name": "system",
+        "tags": {
+            "host": "pg-2",
+            "service": "pg",
+            "note": "käyttäjä ☃",
+        },
+        "timestamp": 1570444470
+    },
+    {
+        "fields": {
+            "Count": 717688622
+        },
+        "name": "kafka.server:BrokerTopicMetrics.BytesInPerSec",
+        "tags": {
+            "host": "k1-3"
+        },
+        "timestamp": 1571666310
+    },
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 64 * 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_metrics(chunk_size, indent):
+    body = json.dumps({"metrics": METRICS}, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert list(iter_metrics(body, chunk_size=chunk_size)) == METRICS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64 * 1024])
+def test_other_keys(chunk_size):
+    body = json.dumps({"version": 12345, "metrics": METRICS, "extra": [1, {"a": "b"}]}).encode("utf-8")
+    assert list(iter_metrics(body, chunk_size=chunk_size)) == METRICS
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 12))
+def test_split_numbers(chunk_size):
+    # Numbers outside the metrics are parsed on their own, so splitting them at any character has to work
+    body = b'{"a": 1.25, "b": -3e-5, "c": 12, "d": 6.02E+23, "metrics": [{"v": 1.5}]}'
+    assert list(iter_metrics(body, chunk_size=chunk_size)) == [{"v": 1.5}]
+
+
+def test_empty():
+    assert not list(iter_metrics(b"{}"))
+    assert not list(iter_metrics(b' { "metrics" : [ ] } '))
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        list(iter_metrics(b"[]"))
+    with pytest.raises(ValueError):
+        list(iter_metrics(b'{"metrics": [{"name": "cpu"} {"name": "mem"}]}'))
+    metrics = iter_metrics(b'{"metrics": [{"name": "cpu"}, {"name": ')
+    assert next(metrics) == {"name": "cpu"}
+    with pytest.raises(ValueError):
+        next(metrics)
@@ -0,0 +1,54 @@
+# Copyright 2019, Aiven, https://aiven.io/
+from sfxbridge.mapper import FrozenDimensions
+from sfxbridge.maps.metrics import DataPointType
+from sfxbridge.suppress import GaugeSuppressor
+
+HOST_A = FrozenDimensions({"host": "a"})
+HOST_B = FrozenDimensions({"host": "b"})
+
+
+def _points(value_a, value_b):
+    return {
+        DataPointType.gauge: [
+            {"metric": "memory.wired", "value": value_a, "dimensions": HOST_A},
+            {"metric": "memory.wired", "value": value_b, "dimensions": HOST_B},
+        ],
+        DataPointType.cumulative: [
+            {"metric": "if_octets.rx", "value": 1, "dimensions": HOST_A},
+        ],
+    }
+
+
+def _sent(points):
+    return [(dp["dimensions"]["host"], dp["value"]) for dp in points.get(DataPointType.gauge, [])]
+
+
+def test_suppress_unchanged():
+    suppressor = GaugeSuppressor(heartbeat=30)
+    start = suppressor._window_start  # pylint: disable=protected-access
+    sent = []
+    for offset, values in [(0, (0, 0)), (10, (0, 1)), (20, (0, 1)), (31, (0, 1)), (65, (0, 1))]:
+        points = _points(*values)
+        suppressor.filter(points, now=start + offset)
+        # Cumulative counters are always sent
+        assert len(points[DataPointType.cumulative]) == 1
+        sent.append(_sent(points))
+
+    assert sent == [
+        [("a", 0), ("b", 0)],
+        [("b", 1)],
+        [],
+        [("a", 0)],
+        [("a", 0), ("b", 1)],
+    ]
+    assert suppressor.suppressed == 4
+    assert suppressor.per_minute == round(4 * 60 / 65, 1)
+
+
+def test_expiry():
+    suppressor = GaugeSuppressor(heartbeat=30)
+    start = suppressor._window_start  # pylint: disable=protected-access
+    suppressor.filter(_points(0, 0), now=start)
+    assert len(suppressor) == 2
+    suppressor.filter({DataPointType.gauge: [{"metric": "load.midterm", "value": 1, "dimensions": HOST_A}]}, now=start + 40)
+    assert len(suppressor) == 1
@@ -0,0 +1,71 @@
+# Copyright 2019, Aiven, https://aiven.io/
+import json
+import logging
+
+from sfxbridge.maps.metrics import DataPointType
+from sfxbridge.trace import TraceWriter
+
+SYSTEM = {"name": "system", "fields": {"load5": 1}}
+MEM = {"name": "mem", "fields": {"free": 2}}
+POINTS = {
+    DataPointType.gauge: [
+        {"metric": "load.midterm", "value": 1, "dimensions": {"host": "a"}},
+        {"metric": "memory.free", "value": 2, "dimensions": {"host": "a"}},
+    ],
+}
+
+
+def _traced(writer, batches):
+    for metrics in batches:
+        if writer.sample():
+            traced = []
+            assert list(writer.collect(iter(metrics), traced)) == metrics
+            writer.write(traced, POINTS)
+    writer.close()
+
+
+def _read(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_sample_rate(tmp_path):
+    path = tmp_path / "trace.json"
+    writer = TraceWriter(log=logging.getLogger(), path=str(path), sample_rate=3)
+    _traced(writer, [[SYSTEM, dict(MEM, fields={"free": index})] for index in range(7)])
+    records = _read(path)
+    assert [record["metrics"][1]["fields"]["free"] for record in records] == [0, 3, 6]
+    assert records[0]["datapoints"] == {"gauge": POINTS[DataPointType.gauge]}
+    assert writer.written == 3
+
+
+def test_measurement_filter(tmp_path):
+    path = tmp_path / "trace.json"
+    writer = TraceWriter(
+        log=logging.getLogger(), path=str(path), measurements=["sys*"], datapoint_names={"load.midterm"}
+    )
+    _traced(writer, [[SYSTEM, MEM], [MEM]])
+    # The batch without matching metrics is not traced
+    records = _read(path)
+    assert len(records) == 1
+    assert records[0]["metrics"] == [SYSTEM]
+    assert records[0]["datapoints"] == {"gauge": POINTS[DataPointType.gauge][:1]}
+
+
+def test_rotation(tmp_path):
+    path = tmp_path / "trace.json"
+    writer = TraceWriter(log=logging.getLogger(), path=str(path), max_bytes=1, backups=2)
+    _traced(writer, [[dict(SYSTEM, fields={"load5": index})] for index in range(4)])
+    assert writer.rotations == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["trace.json", "trace.json.1", "trace.json.2"]
+    for name, value in [("trace.json", 3), ("trace.json.1", 2), ("trace.json.2", 1)]:
+        assert [record["metrics"][0]["fields"]["load5"] for record in _read(tmp_path / name)] == [value]
+
+
+def test_queue_full(tmp_path):
+    writer = TraceWriter(log=logging.getLogger(), path=str(tmp_path / "trace.json"), queue_size=1)
+    # Pretend the writer thread is running, but stuck
+    writer._thread = object()  # pylint: disable=protected-access
+    writer.write([SYSTEM], POINTS)
+    writer.write([SYSTEM], POINTS)
+    assert writer.dropped == 1
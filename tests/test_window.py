@@ -0,0 +1,33 @@
+# Copyright 2019, Aiven, https://aiven.io/
+from sfxbridge.window import BatchWindow
+
+
+def test_batch_window():
+    window = BatchWindow(4)
+    assert window.summary() == {"batches": 0}
+
+    # The first batch is overwritten by the last
+    results = ["failed", "sent", "sent", None, "rejected"]
+    for index, result in enumerate(results):
+        window.record(
+            received_bytes=1000,
+            metrics=10,
+            datapoints=100,
+            map_time=0.001 * (index + 1),
+            send_time=0.1 * (index + 1),
+            result=result,
+            now=100.0 + index,
+        )
+
+    assert window.summary(now=105.0) == {
+        "batches": 4,
+        "seconds": 4.0,
+        "received-bytes": 4000,
+        "metrics-per-second": 10.0,
+        "datapoints-per-second": 100.0,
+        "map-time-p50": 0.004,
+        "map-time-p99": 0.005,
+        "send-time-p50": 0.4,
+        "send-time-p99": 0.5,
+        "drop-rate": round(1 / 3, 4),
+    }